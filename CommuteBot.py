@@ -0,0 +1,260 @@
+import os
+import time
+import logging
+
+import quota
+import upstream
+import metrics
+import arrival_solver
+import departure_sweep
+from route_cache import RouteCache
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+DISTANCE_MATRIX_PATH = '/maps/api/distancematrix/json'
+DIRECTIONS_PATH = '/maps/api/directions/json'
+
+route_cache = RouteCache()
+# 相同路線與時間格同時只送一次 Google；回應直接寫到鎖檔旁給其他 worker 共用
+route_flight = SingleFlight("route", share_results=True)
+
+# 路線查詢失敗，訊息可直接回覆給用戶
+class RouteError(Exception):
+    pass
+
+# 查詢 Distance Matrix，相同路線與時間格的結果直接取快取
+# calls 若有傳入，每次實際呼叫 Google 時會記錄一筆，用來統計計費次數
+# coarse 為 True（額度快用完）時，鄰近時間格或剛過期的快取也直接使用
+def query_distance_matrix(origin, destination, mode, time_type, timestamp, calls=None, coarse=False):
+    key = route_cache.key(origin, destination, mode, time_type, timestamp)
+    cached = route_cache.get(key)
+    if cached is None and coarse:
+        cached = route_cache.nearest(key)
+        if cached is not None:
+            metrics.cache_result("route", True, stale=True)
+            return cached
+    metrics.cache_result("route", cached is not None)
+    if cached is not None:
+        return cached
+
+    params = {
+        'destinations': destination,
+        'language': 'zh-TW',
+        'mode': mode,
+        'origins': origin,
+        'key': GOOGLE_API_KEY
+    }
+    if time_type == 'arrival':
+        params['arrival_time'] = timestamp
+    else:
+        params['departure_time'] = timestamp
+    if mode == 'driving':
+        params['traffic_model'] = 'best_guess'
+
+    def fetch():
+        if calls is not None:
+            calls.append(timestamp)
+        with metrics.stage("distance_matrix"):
+            return upstream.get('google', DISTANCE_MATRIX_PATH, params=params).json()
+
+    response = route_flight.do(key, fetch)
+    logger.info(f"API回傳 origin_addresses: {response.get('origin_addresses')}, destination_addresses: {response.get('destination_addresses')}")
+
+    # 只快取成功的結果，錯誤留給下次重試
+    if response.get('status') == 'OK':
+        route_cache.set(key, response)
+    return response
+
+# 查詢 Directions 取得路線幾何（各路段的 polyline 與耗時），與 Distance Matrix 共用快取
+def query_directions(origin, destination, mode, departure):
+    key = route_cache.key(origin, destination, mode, 'directions', departure)
+    cached = route_cache.get(key)
+    metrics.cache_result("route", cached is not None)
+    if cached is not None:
+        return cached
+
+    params = {
+        'origin': origin,
+        'destination': destination,
+        'language': 'zh-TW',
+        'mode': mode,
+        'key': GOOGLE_API_KEY
+    }
+    if mode in ('driving', 'transit'):
+        params['departure_time'] = departure
+    def fetch():
+        with metrics.stage("directions"):
+            return upstream.get('google', DIRECTIONS_PATH, params=params).json()
+
+    response = route_flight.do(key, fetch)
+    if response.get('status') == 'OK':
+        route_cache.set(key, response)
+    else:
+        logger.warning(f"Directions 回傳異常: {response.get('status')}, {response.get('error_message', '')}")
+    return response
+
+# 反推抵達時間與出發時間掃描用的 evaluate(departure)：回傳 (通勤秒數, Distance Matrix 的 element)，
+# 查詢失敗時拋出 RouteError。會在其他執行緒呼叫，沿用建立時呼叫端的優先順序
+def duration_evaluator(origin, destination, mode, calls, coarse):
+    level = quota.current_priority()
+
+    def evaluate(departure):
+        with quota.priority(level):
+            response = query_distance_matrix(origin, destination, mode, 'departure', departure,
+                                             calls=calls, coarse=coarse)
+        if response.get('status') != 'OK' or not response.get('rows'):
+            raise RouteError(f"Google API 回傳異常: {response.get('status')}")
+        element = response['rows'][0]['elements'][0]
+        if element.get('status') != 'OK':
+            raise RouteError(f"路線查詢失敗：{element.get('status')}")
+        duration = element.get('duration_in_traffic') or element['duration']
+        return duration['value'], element
+
+    return evaluate
+
+# 出發時間範圍內找通勤時間最短的時間點，回傳最佳出發時間與各取樣時間的通勤時間
+def get_departure_sweep(origin, destination, start_str, end_str, mode):
+    try:
+        start = int(time.mktime(time.strptime(start_str, "%Y-%m-%d %H:%M")))
+        end = int(time.mktime(time.strptime(end_str, "%Y-%m-%d %H:%M")))
+        step = departure_sweep.SWEEP_STEP_MINUTES * 60
+        if start <= time.time():
+            return {"error": "選擇的時間必須是未來時間，請重新設定"}
+        if end < start:
+            end = start
+
+        coarse = quota.manager.low('google')
+        calls = []
+        evaluate = duration_evaluator(origin, destination, mode, calls, coarse)
+
+        if coarse:
+            # 額度快用完時只查頭、中、尾三個時間
+            solution = departure_sweep.sweep(evaluate, start, end, step, max_calls=3, coarse_points=3)
+        else:
+            solution = departure_sweep.sweep(evaluate, start, end, step)
+
+        element = solution['detail']
+        duration = element.get('duration_in_traffic') or element['duration']
+        return {
+            "duration_minutes": solution['duration'] // 60,
+            "duration_text": duration['text'],
+            "best_departure_time": time.strftime("%Y-%m-%d %H:%M", time.localtime(solution['departure'])),
+            "estimated_arrival_time": time.strftime(
+                "%Y-%m-%d %H:%M", time.localtime(solution['departure'] + solution['duration'])
+            ),
+            "distance_text": element['distance']['text'],
+            "curve": [
+                (time.strftime("%H:%M", time.localtime(departure)), seconds // 60)
+                for departure, seconds in solution['curve']
+            ],
+            "api_calls": len(calls)
+        }
+
+    except RouteError as e:
+        return {"error": str(e)}
+    except quota.QuotaExceededError as e:
+        logger.warning(f"Google API 額度不足，略過出發時間掃描：{e}")
+        return {"error": "路線查詢量已達上限，請稍後再試"}
+    except upstream.CircuitOpenError:
+        logger.warning("Google API 斷路中，略過出發時間掃描")
+        return {"error": "路線查詢服務暫時無法使用，請稍後再試"}
+    except Exception:
+        logger.exception("出發時間掃描發生未預期錯誤")
+        return {"error": "系統暫時無法查詢路線，請稍後再試"}
+
+# Google Distance Matrix 查詢
+def get_commute_info(origin, destination, datetime_str, mode, time_type):
+    try:
+        # 將用戶輸入的日期時間轉為 timestamp
+        dt = time.strptime(datetime_str, "%Y-%m-%d %H:%M")
+        dt_timestamp = int(time.mktime(dt))
+        now_timestamp = int(time.time())
+
+        if dt_timestamp <= now_timestamp:
+            return {"error": "選擇的時間必須是未來時間，請重新設定"}
+
+        # Google 額度快用完時改用快取與較少次數的反推
+        coarse = quota.manager.low('google')
+
+        # 處理非大眾運輸模式的抵達時間：只能指定出發時間，透過反推方式找最佳出發時間
+        if mode != 'transit' and time_type == 'arrival':
+            calls = []
+            evaluate = duration_evaluator(origin, destination, mode, calls, coarse)
+
+            if coarse:
+                # 只做一次定點修正：最多 2 次查詢，誤差約為前後兩次通勤時間的差
+                solution = arrival_solver.solve(evaluate, dt_timestamp, max_rounds=2, probes=1)
+            else:
+                solution = arrival_solver.solve(evaluate, dt_timestamp)
+            solver_mode = "coarse" if coarse else "full"
+            metrics.inc("arrival_solves_total", mode=solver_mode)
+            metrics.inc("arrival_solver_rounds_total", solution['rounds'], mode=solver_mode)
+            metrics.inc("arrival_solver_api_calls_total", len(calls), mode=solver_mode)
+
+            duration_sec = solution['duration']
+            element = solution['detail']
+            best_departure_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(solution['departure']))
+            duration_text = element['duration']['text']
+            distance_text = element['distance']['text']
+
+            return {
+                "duration_minutes": duration_sec // 60,
+                "duration_text": duration_text,
+                "best_departure_time": best_departure_str,
+                "distance_text": distance_text,
+                "estimated_arrival_time": datetime_str,
+                "api_calls": len(calls)
+            }
+
+        # 正式發送請求（大眾運輸可直接指定抵達時間）
+        response = query_distance_matrix(origin, destination, mode, time_type, dt_timestamp, coarse=coarse)
+
+        if response.get('status') != 'OK':
+            logger.warning(f"Google API 回傳異常: {response.get('status')}, {response.get('error_message', '')}")
+            return {"error": f"Google API 回傳異常: {response.get('status')}"}
+        if not response.get('rows') or not response['rows'][0].get('elements'):
+            return {"error": "Google API 回傳資料異常，請檢查地址是否正確"}
+
+        element = response['rows'][0]['elements'][0]
+        if element.get('status') != 'OK':
+            return {"error": f"路線查詢失敗：{element.get('status')}"}
+
+        # 取得距離與時間
+        distance_text = element['distance']['text']
+        distance_value = element['distance']['value']
+
+        if mode == 'driving' and 'duration_in_traffic' in element:
+            duration_sec = element['duration_in_traffic']['value']
+            duration_text = element['duration_in_traffic']['text']
+        else:
+            duration_sec = element['duration']['value']
+            duration_text = element['duration']['text']
+
+        best_departure_time = dt_timestamp if time_type == 'departure' else dt_timestamp - duration_sec
+        best_departure_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(best_departure_time))
+
+        estimated_arrival_timestamp = best_departure_time + duration_sec
+        estimated_arrival_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(estimated_arrival_timestamp))
+
+        return {
+            "duration_minutes": duration_sec // 60,
+            "duration_text": duration_text,
+            "best_departure_time": best_departure_str,
+            "estimated_arrival_time": estimated_arrival_str,
+            "distance_text": distance_text,
+            "distance_value": distance_value
+        }
+
+    except RouteError as e:
+        return {"error": str(e)}
+    except quota.QuotaExceededError as e:
+        logger.warning(f"Google API 額度不足，略過路線查詢：{e}")
+        return {"error": "路線查詢量已達上限，請稍後再試"}
+    except upstream.CircuitOpenError:
+        logger.warning("Google API 斷路中，略過路線查詢")
+        return {"error": "路線查詢服務暫時無法使用，請稍後再試"}
+    except Exception:
+        logger.exception("通勤計算發生未預期錯誤")
+        return {"error": "系統暫時無法查詢路線，請稍後再試"}
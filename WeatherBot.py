@@ -1,14 +1,98 @@
-import requests
 from dotenv import load_dotenv
 import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import json
+import cwa_registry
+import quota
+import upstream
+import metrics
+from forecast_index import ForecastIndex
+from forecast_store import ForecastStore
+from forecast_snapshot import FORECAST_SNAPSHOT_PATH
+from gazetteer import Gazetteer
+from singleflight import SingleFlight, SingleFlightTimeout
+from geocache import GeoCache, normalize_place, GEOCODE_NEGATIVE_TTL
+
+logger = logging.getLogger(__name__)
 
 CWB_API_KEY = os.getenv('CWB_API_KEY')
+# 回覆給用戶的錯誤訊息，例外內容只寫進日誌
+WEATHER_UNAVAILABLE_TEXT = "天氣資料暫時無法取得，請稍後再試"
+GEOCODE_UNAVAILABLE_ERROR = "地址查詢暫時無法使用"
+
+geocode_cache = GeoCache()
+gazetteer = Gazetteer.load()
+# 同一地名同時只送一次 Nominatim，其他 worker 等待後從共用的 SQLite 快取讀取結果
+geocode_flight = SingleFlight("geocode")
+# 過期的地理編碼先沿用，在背景重新查詢；Nominatim 每秒只能查一次，一條執行緒就夠
+_geocode_refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="geocode-refresh")
+_refreshing = set()
+_refreshing_lock = threading.Lock()
 
-# 取得縣市與區（鄉鎮）
+# 取得縣市與區（鄉鎮）：地名含鄉鎮名稱或為經緯度時直接離線解析，其次查快取，最後才送 Nominatim
 def get_city_and_district(place_name):
-    url = "https://nominatim.openstreetmap.org/search"
+    with metrics.stage("geocode"):
+        local = gazetteer.resolve(place_name)
+        metrics.cache_result("gazetteer", local is not None)
+        if local is not None:
+            return {"city": local[0], "district": local[1]}
+
+        key = normalize_place(place_name)
+        cached = geocode_cache.lookup(key)
+        if cached is not None:
+            value, fresh = cached
+            metrics.cache_result("geocode", True, stale=not fresh)
+            if not fresh:
+                _refresh_geocode_later(place_name, key)
+            return dict(value)
+        metrics.cache_result("geocode", False)
+
+        try:
+            result = geocode_flight.do(key, lambda: _fetch_geocode(place_name, key), recheck=lambda: _cached_geocode(key))
+        except SingleFlightTimeout:
+            logger.warning(f"等待「{place_name}」的地址查詢逾時")
+            return {"city": "未知縣市", "district": "未知鄉鎮區", "error": GEOCODE_UNAVAILABLE_ERROR}
+        return dict(result)
+
+def _fetch_geocode(place_name, key):
+    result = _query_nominatim(place_name)
+    _cache_geocode(key, result)
+    return result
+
+def _cached_geocode(key):
+    cached = geocode_cache.lookup(key)
+    if cached is not None and cached[1]:
+        return cached[0]
+    return None
+
+# 成功的結果與「找不到地址」才寫入快取，暫時性錯誤留給下次重試
+def _cache_geocode(key, result):
+    if "error" not in result:
+        geocode_cache.set(key, result)
+    elif result["error"] == "找不到地址":
+        geocode_cache.set(key, result, ttl=GEOCODE_NEGATIVE_TTL)
+
+def _refresh_geocode_later(place_name, key):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    _geocode_refresher.submit(_refresh_geocode, place_name, key)
+
+def _refresh_geocode(place_name, key):
+    try:
+        with quota.priority(quota.PREWARM):
+            geocode_flight.do(key, lambda: _fetch_geocode(place_name, key), recheck=lambda: _cached_geocode(key))
+    except Exception:
+        logger.warning(f"背景更新「{place_name}」的地址失敗", exc_info=True)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+def _query_nominatim(place_name):
     params = {
         "q": place_name,
         "format": "json",
@@ -20,12 +104,18 @@ def get_city_and_district(place_name):
     }
 
     try:
-        response = requests.get(url, params=params, headers=headers)
+        response = upstream.get("nominatim", "/search", params=params, headers=headers)
         data = response.json()
 
         if not data:
             return {"city": "未知縣市", "district": "未知鄉鎮區", "error": "找不到地址"}
 
+        lat, lon = data[0]["lat"], data[0]["lon"]
+        # 優先用座標或 address 欄位對應到 CWA 的鄉鎮名稱，都對不上才用原本的欄位順序
+        matched = gazetteer.locate(float(lat), float(lon)) or gazetteer.match_address(data[0]["address"])
+        if matched is not None:
+            return {"city": matched[0], "district": matched[1], "lat": lat, "lon": lon}
+
         address = data[0]["address"]
         district = (
             address.get("town") or
@@ -45,133 +135,114 @@ def get_city_and_district(place_name):
         return {
             "city": city,
             "district": district,
-            "lat": data[0]["lat"],
-            "lon": data[0]["lon"]
+            "lat": lat,
+            "lon": lon
         }
-    except Exception as e:
-        return {"city": "未知縣市", "district": "未知鄉鎮區", "error": str(e)}
+    except Exception:
+        logger.warning(f"Nominatim 查詢「{place_name}」失敗", exc_info=True)
+        return {"city": "未知縣市", "district": "未知鄉鎮區", "error": GEOCODE_UNAVAILABLE_ERROR}
+
+# 下載整個縣市的預報資料集（不限鄉鎮，只取會用到的天氣因子）
+def fetch_forecast_dataset(dataset_id):
+    with metrics.stage("weather_fetch"):
+        response = upstream.get(
+            "cwa", f"/api/v1/rest/datastore/{dataset_id}",
+            params=cwa_registry.county_params(dataset_id, CWB_API_KEY)
+        )
+        return response.json()
 
-# 查詢天氣（目前只支援桃園市）
+# 下載並建立查詢索引，兩段分開計時
+def load_forecast(dataset_id):
+    data = fetch_forecast_dataset(dataset_id)
+    with metrics.stage("weather_parse"):
+        return ForecastIndex(data)
+
+forecast_store = ForecastStore(load_forecast, snapshot_path=FORECAST_SNAPSHOT_PATH, flight=SingleFlight("forecast"))
+
+# 查詢天氣，依查詢時間選擇 3 天或一週預報，資料來自縣市層級的預報快取
 def get_weather(city, district, time, more=True):
-    try:
-        if city == "桃園市":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-007?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "新北市":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-071?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "臺北市":  
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-063?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "臺中市":          
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-075?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "臺南市":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-079?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "高雄市":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-067?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "基隆市":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-051?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "新竹市": 
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-055?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "新竹縣":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-011?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "嘉義市":  
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-059?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "宜蘭縣":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-003?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "花蓮縣": 
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-043?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "臺東縣":     
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-039?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "苗栗縣":  
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-015?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "彰化縣":  
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-019?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "南投縣":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-023?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "雲林縣":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-027?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "嘉義縣":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-031?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "屏東縣":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-035?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "澎湖縣": 
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-047?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "金門縣":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-087?Authorization={CWB_API_KEY}&locationName={district}"
-        elif city == "連江縣":
-            url = f"https://opendata.cwa.gov.tw/api/v1/rest/datastore/F-D0047-083?Authorization={CWB_API_KEY}&locationName={district}"
-        response = requests.get(url)
-        data = response.json()
+    return _weather_text(forecast_store.get, city, district, time, more)
+
+# 一次查詢多組 (縣市, 鄉鎮, 時間)，同一個縣市資料集只向預報快取取一次，回傳與輸入同順序的文字
+def get_weather_batch(queries, more=False):
+    indexes = {}
+
+    def index_for(dataset_id):
+        if dataset_id not in indexes:
+            indexes[dataset_id] = forecast_store.get(dataset_id)
+        return indexes[dataset_id]
+
+    return [_weather_text(index_for, city, district, time, more) for city, district, time in queries]
 
+def _weather_text(index_for, city, district, time, more):
+    try:
         target_time = datetime.fromisoformat(time)
+        product = cwa_registry.select_product(target_time)
+        try:
+            dataset_id = cwa_registry.dataset_id(city, product)
+        except cwa_registry.UnknownCityError:
+            return f"目前不支援查詢「{city}」的天氣"
+        index = index_for(dataset_id)
+
+        # 每個天氣因子只做一次 bisect 查詢，不再逐筆掃描
+        def value_at(element_name):
+            return index.value_at(district, element_name, target_time) or {}
 
-        weather_text = None
-        min_temp = None
-        max_temp = None
-        uv_index = None
-        uv_level = None
-        min_Apparent_temp = None
-        max_Apparent_temp = None
+        weather_text = value_at("天氣現象").get("Weather")
+
+        if product == cwa_registry.THREE_DAY:
+            temp = value_at("溫度").get("Temperature")
+            apparent_temp = value_at("體感溫度").get("ApparentTemperature")
+            temp_text = f"氣溫攝氏 {temp} 度" if temp else None
+            apparent_text = f"體感溫度攝氏 {apparent_temp} 度" if apparent_temp else None
+            pop = value_at("3小時降雨機率").get("ProbabilityOfPrecipitation")
+        else:
+            min_temp = value_at("最低溫度").get("MinTemperature")
+            max_temp = value_at("最高溫度").get("MaxTemperature")
+            min_Apparent_temp = value_at("最低體感溫度").get("MinApparentTemperature")
+            max_Apparent_temp = value_at("最高體感溫度").get("MaxApparentTemperature")
+            temp_text = f"氣溫範圍攝氏 {min_temp}~{max_temp} 度" if min_temp and max_temp else None
+            apparent_text = None
+            if min_Apparent_temp and max_Apparent_temp:
+                apparent_text = f"體感溫度範圍攝氏 {min_Apparent_temp}~{max_Apparent_temp} 度"
+            pop = value_at("12小時降雨機率").get("ProbabilityOfPrecipitation")
+
+        # 降雨機率
         pop_text = "天數過多無法預測"
-        uv_text = "查詢時間為晚間，無提供紫外線資料"
-
-        for location in data["records"]["Locations"]:
-            for loc in location["Location"]:
-                for element in loc["WeatherElement"]:
-                    for entry in element["Time"]:
-                        start = datetime.fromisoformat(entry["StartTime"].replace("+08:00", ""))
-                        end = datetime.fromisoformat(entry["EndTime"].replace("+08:00", ""))
-                        if not (start <= target_time < end):
-                            continue
-
-                        # 天氣現象
-                        if element["ElementName"] == "天氣現象" and not weather_text:
-                            weather_text = entry["ElementValue"][0].get("Weather")
-
-                        # 最低溫度
-                        elif element["ElementName"] == "最低溫度" and not min_temp:
-                            min_temp = entry["ElementValue"][0].get("MinTemperature")
-
-                        # 最高溫度
-                        elif element["ElementName"] == "最高溫度" and not max_temp:
-                            max_temp = entry["ElementValue"][0].get("MaxTemperature")
-
-                        # 最低體感溫度
-                        elif element["ElementName"] == "最低體感溫度" and not min_Apparent_temp:
-                            min_Apparent_temp = entry["ElementValue"][0].get("MinApparentTemperature")
-
-                        # 最高體感溫度
-                        elif element["ElementName"] == "最高體感溫度" and not max_Apparent_temp:
-                            max_Apparent_temp = entry["ElementValue"][0].get("MaxApparentTemperature")
-
-                        # 降雨機率
-                        elif element["ElementName"] == "12小時降雨機率":
-                            value = entry["ElementValue"][0].get("ProbabilityOfPrecipitation")
-                            if value and value != "-":
-                                pop_text = f"降雨機率：{value}%"
-                        # 紫外線指數與等級
-                        elif element["ElementName"] == "紫外線指數" :
-                            uv_data = entry["ElementValue"][0]
-                            uv_index = uv_data.get("UVIndex")
-                            uv_level = uv_data.get("UVExposureLevel")
-                            if uv_index and uv_level != None:
-                                uv_text = f"紫外線指數：{uv_index}，等級：{uv_level}"
+        if pop and pop != "-":
+            pop_text = f"降雨機率：{pop}%"
 
         result_parts = []
         if weather_text:
             result_parts.append(weather_text)
-        if min_temp and max_temp:
-            result_parts.append(f"氣溫範圍攝氏 {min_temp}~{max_temp} 度")
+        if temp_text:
+            result_parts.append(temp_text)
         if pop_text:
             result_parts.append(pop_text)
         if(more == True):
-            if min_Apparent_temp and max_Apparent_temp:
-                result_parts.append(f"體感溫度範圍攝氏 {min_Apparent_temp}~{max_Apparent_temp} 度")
-            
+            if apparent_text:
+                result_parts.append(apparent_text)
+
+            # 紫外線指數與等級只有一週預報提供
+            uv_text = "查詢時間為晚間，無提供紫外線資料"
+            uv_source = index
+            if product == cwa_registry.THREE_DAY:
+                uv_source = index_for(cwa_registry.dataset_id(city, cwa_registry.WEEKLY))
+            uv_data = uv_source.value_at(district, "紫外線指數", target_time) or {}
+            uv_index = uv_data.get("UVIndex")
+            uv_level = uv_data.get("UVExposureLevel")
+            if uv_index and uv_level != None:
+                uv_text = f"紫外線指數：{uv_index}，等級：{uv_level}"
             result_parts.append(uv_text)
 
         return "\n".join(result_parts) if result_parts else "查無該時間的天氣資料"
 
-    except Exception as e:
-        return f"天氣資料錯誤：{e}"
+    except upstream.CircuitOpenError:
+        logger.warning(f"CWA 斷路中，無法查詢 {city}{district} 的天氣")
+        return WEATHER_UNAVAILABLE_TEXT
+    except Exception:
+        logger.exception(f"查詢 {city}{district} 的天氣失敗")
+        return WEATHER_UNAVAILABLE_TEXT
 
 
 # 測試程式區
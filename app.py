@@ -1,175 +1,121 @@
 import os
 import time
 import logging
+from functools import partial
 from flask import Flask, request
 from linebot import LineBotApi, WebhookHandler
+from linebot.exceptions import LineBotApiError
 from linebot.models import (
-    RichMenu, RichMenuArea, RichMenuBounds, RichMenuSize,MessageAction,
     MessageEvent, TextMessage, TextSendMessage, 
     PostbackEvent, QuickReply, QuickReplyButton, PostbackAction,
     TemplateSendMessage, ButtonsTemplate, DatetimePickerAction
 )
 from dotenv import load_dotenv
-import requests
-from WeatherBot import get_city_and_district, get_weather
+
+# 載入環境變數（需在匯入會讀取設定的模組之前）
+load_dotenv()
+
+import fanout
+import metrics
+import route_weather
+import webhook_worker
+from reminders import ReminderScheduler
+from rich_menu import sync_rich_menu
+from session_store import create_session_store, new_session
+from event_store import create_event_store
+from CommuteBot import get_commute_info, get_departure_sweep
+from WeatherBot import get_city_and_district, get_weather, forecast_store
 
 # 初始化日誌
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# 載入環境變數
-load_dotenv()
-
 LINE_CHANNEL_ACCESS_TOKEN = os.getenv('LINE_CHANNEL_ACCESS_TOKEN')
 LINE_CHANNEL_SECRET = os.getenv('LINE_CHANNEL_SECRET')
-GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+# reply token 的有效時間（秒），超過就直接改用 push
+REPLY_TOKEN_TTL = int(os.getenv('REPLY_TOKEN_TTL', 50))
+# 通勤設定查詢的回覆期限（秒），逾時的天氣資料以提示文字代替
+COMMUTE_REPLY_DEADLINE = float(os.getenv('COMMUTE_REPLY_DEADLINE', 8))
+# 沿途天氣是附加資訊：通勤與兩地天氣都查完後最多再等幾秒，來不及就不附上
+ROUTE_WEATHER_WAIT = float(os.getenv('ROUTE_WEATHER_WAIT', 1))
+WEATHER_TIMEOUT_TEXT = "天氣資料查詢逾時，請稍後再試"
+# 查詢期間用戶已重新設定或改選其他時間，這次的結果不覆蓋設定、也不建立提醒
+SESSION_CHANGED_TEXT = "⚠️ 查詢期間設定已變更，這次的結果未設定通勤提醒"
+# 找最佳出發時間時可選的出發時間範圍（分鐘），只提供給通勤時間會隨路況、班次變化的交通方式
+SWEEP_WINDOWS = (60, 120, 180)
+SWEEP_MODES = ('driving', 'transit')
+MODE_DISPLAY = {
+    'transit': '大眾運輸',
+    'driving': '開車',
+    'walking': '步行',
+    'bicycling': '腳踏車'
+}
 
 app = Flask(__name__)
-line_bot_api = LineBotApi(LINE_CHANNEL_ACCESS_TOKEN)
+line_bot_api = LineBotApi(
+    LINE_CHANNEL_ACCESS_TOKEN,
+    endpoint=os.getenv('LINE_API_ENDPOINT', LineBotApi.DEFAULT_API_ENDPOINT)
+)
 handler = WebhookHandler(LINE_CHANNEL_SECRET)
-# 暫存用戶狀態與資料（正式建議用資料庫）
-user_states = {}
-user_data = {}
-
-# Google Distance Matrix 查詢
-def get_commute_info(origin, destination, datetime_str, mode, time_type):
-    try:
-        # 將用戶輸入的日期時間轉為 timestamp
-        dt = time.strptime(datetime_str, "%Y-%m-%d %H:%M")
-        dt_timestamp = int(time.mktime(dt))
-        now_timestamp = int(time.time())
-
-        if dt_timestamp <= now_timestamp:
-            return {"error": "選擇的時間必須是未來時間，請重新設定"}
-
-        url = 'https://maps.googleapis.com/maps/api/distancematrix/json'
-        params = {
-            'destinations': destination,
-            'language': 'zh-TW',
-            'mode': mode,
-            'origins': origin,
-            'key': GOOGLE_API_KEY
-
-        }
-
-        # 處理大眾運輸模式
-        if mode == 'transit':
-            if time_type == 'arrival':
-                params['arrival_time'] = dt_timestamp
-            else:
-                params['departure_time'] = dt_timestamp
-
-        # 處理非大眾運輸模式
-        else:
-            if mode == 'driving':
-                params['traffic_model'] = 'best_guess'
-
-            if time_type == 'arrival':
-                # 透過反推方式找最佳出發時間
-                arrival_timestamp = dt_timestamp
-                guess_departure = arrival_timestamp - 3600  # 初始猜測為提早1小時
-                for _ in range(10):
-                    params['departure_time'] = guess_departure
-                    response = requests.get(url, params=params).json()
-                    element = response['rows'][0]['elements'][0]
-
-                    if 'duration_in_traffic' in element:
-                        duration_sec = element['duration_in_traffic']['value']
-                        duration_text = element['duration_in_traffic']['text']
-                    else:
-                        duration_sec = element['duration']['value']
-                        duration_text = element['duration']['text']
-
-                    new_departure = arrival_timestamp - duration_sec
-                    if abs(new_departure - guess_departure) < 30:
-                        break
-                    guess_departure = new_departure
-
-                best_departure_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(guess_departure))
-                duration_text = element['duration']['text']
-                distance_text = element['distance']['text']
-
-                return {
-                    "duration_minutes": duration_sec // 60,
-                    "duration_text": duration_text,
-                    "best_departure_time": best_departure_str,
-                    "distance_text": distance_text,
-                    "estimated_arrival_time": datetime_str
-                }
-            else:
-                # time_type == 'departure'
-                params['departure_time'] = dt_timestamp
-
-        # 正式發送請求
-        response = requests.get(url, params=params).json()
-        logger.info(f"API回傳 origin_addresses: {response.get('origin_addresses')}, destination_addresses: {response.get('destination_addresses')}")
-        
-        if response.get('status') != 'OK':
-            return {"error": f"Google API 回傳異常: {response.get('status')}, {response.get('error_message', '')}"}
-        if not response.get('rows') or not response['rows'][0].get('elements'):
-            return {"error": "Google API 回傳資料異常，請檢查地址是否正確"}
-
-        element = response['rows'][0]['elements'][0]
-        if element.get('status') != 'OK':
-            return {"error": f"路線查詢失敗：{element.get('status')}"}
-
-        # 取得距離與時間
-        distance_text = element['distance']['text']
-        distance_value = element['distance']['value']
-
-        if mode == 'driving' and 'duration_in_traffic' in element:
-            duration_sec = element['duration_in_traffic']['value']
-            duration_text = element['duration_in_traffic']['text']
-        else:
-            duration_sec = element['duration']['value']
-            duration_text = element['duration']['text']
-
-        best_departure_time = dt_timestamp if time_type == 'departure' else dt_timestamp - duration_sec
-        best_departure_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(best_departure_time))
-
-        estimated_arrival_timestamp = best_departure_time + duration_sec
-        estimated_arrival_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(estimated_arrival_timestamp))
-
-        return {
-            "duration_minutes": duration_sec // 60,
-            "duration_text": duration_text,
-            "best_departure_time": best_departure_str,
-            "estimated_arrival_time": estimated_arrival_str,
-            "distance_text": distance_text,
-            "distance_value": distance_value
-        }
+# 每個行程各自保存縣市預報，依 CWA 發布時間排程更新
+scheduler = forecast_store.start()
+# 通勤提醒與預報共用同一個排程器
+reminder_scheduler = ReminderScheduler(
+    multicast=lambda user_ids, text: line_bot_api.multicast(user_ids, TextSendMessage(text=text))
+)
+reminder_scheduler.start(scheduler)
+# Webhook 事件依用戶分組平行處理；WEBHOOK_ASYNC=1 時改為背景處理
+event_executor = webhook_worker.KeyedExecutor()
+# 用戶對話狀態與資料，後端由 SESSION_BACKEND 決定（多 worker 部署請用 sqlite 或 redis）
+sessions = create_session_store()
+# 已處理的 webhookEventId，LINE 重送時不再重跑整個流程；後端由 EVENT_STORE_BACKEND 決定，預設與 SESSION_BACKEND 相同
+processed_events = create_event_store()
+
+# 回覆訊息；背景處理時 reply token 可能已過期，改用 push 發送
+def reply_message(event, messages):
+    with metrics.stage("reply"):
+        _send_reply(event, messages)
+
+def _send_reply(event, messages):
+    if time.time() - event.timestamp / 1000 < REPLY_TOKEN_TTL:
+        try:
+            line_bot_api.reply_message(event.reply_token, messages)
+            return
+        except LineBotApiError as e:
+            if e.status_code != 400:
+                raise
+            logger.warning(f"reply token 無法使用，改用 push 發送：{e.error.message}")
+    line_bot_api.push_message(event.source.sender_id, messages)
 
-    except Exception as e:
-        logger.exception("通勤計算發生未預期錯誤")
-        return {"error": f"系統錯誤：{str(e)}"}
-    
-def create_rich_menu():
-    rich_menu = RichMenu(
-        size=RichMenuSize(width=2500, height=843),
-        selected=True,
-        name="功能選單",
-        chat_bar_text="點擊開啟選單",
-        areas=[
-            RichMenuArea(
-                bounds=RichMenuBounds(x=0, y=0, width=1250, height=843),
-                action=MessageAction(label='切換到天氣查詢', text='切換到天氣查詢')
-            ),
-            RichMenuArea(
-                bounds=RichMenuBounds(x=1250, y=0, width=1250, height=843),
-                action=MessageAction(label='設定通勤', text='設定通勤')
-            )
-        ]
-    )
-    return rich_menu
+# Prometheus 指標，多 worker 時加總所有 worker 的數值
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
 
 # Webhook
 @app.route("/callback", methods=["POST"])
 def callback():
+    with metrics.stage("webhook"):
+        return _callback()
+
+def _callback():
     try:
         signature = request.headers['X-Line-Signature']
         body = request.get_data(as_text=True)
-        handler.handle(body, signature)
+        events = handler.parser.parse(body, signature)
+        if not webhook_worker.WEBHOOK_ASYNC:
+            webhook_worker.dispatch_payload(event_executor, handler, events, processed_events)
+            return 'OK'
+
+        # 驗證簽章後先把整批事件排入背景佇列，立即回覆 200；放不下時一個都不排入
+        event_executor.submit_many([
+            (webhook_worker.event_key(event), webhook_worker.dispatch_event, (handler, event, processed_events))
+            for event in events
+        ])
         return 'OK'
+    except webhook_worker.QueueFullError:
+        logger.warning("背景佇列已滿，請 LINE 稍後重送")
+        return 'Busy', 503
     except Exception as e:
         logger.exception("處理 Webhook 時發生錯誤")
         return 'Error', 500
@@ -179,69 +125,120 @@ def callback():
 def handle_message(event):
     user_id = event.source.user_id
     text = event.message.text.strip()
-    state = user_states.get(user_id, 'start')
     mode_map = {'1': 'transit', '2': 'driving', '3': 'walking', '4': 'bicycling'}
-    user_states.setdefault(user_id, 'start')
-
-    if text.lower() in ["設定通勤", "start"]:
-        user_states[user_id] = 'awaiting_origin'
-        user_data[user_id] = {}
-        reply = "請輸入出發地"
-    elif state == 'awaiting_origin':
-        user_data[user_id]['origin'] = text
-        user_states[user_id] = 'awaiting_destination'
-        reply = "請輸入目的地"
-    elif state == 'awaiting_destination':
-        user_data[user_id]['destination'] = text
-        user_states[user_id] = 'awaiting_mode'
-        reply = "請選擇通勤方式：\n1. 大眾運輸\n2. 開車\n3. 步行\n4. 腳踏車\n請輸入數字（例如 1）"
-
-    elif state == 'awaiting_mode':
-        if text not in mode_map:
-            reply = "請輸入正確的數字（1~4）"
-        else:
-            user_data[user_id]['mode'] = mode_map[text]
-            user_states[user_id] = 'awaiting_time_type'
-            reply = TextSendMessage(
-                text="請選擇你要設定的是『出發』還是『抵達』日期時間？",
-                quick_reply=QuickReply(items=[
+    reply = None
+
+    # 狀態轉移在 sessions.update 內原子完成，回覆訊息等寫回後再送出
+    def transition(session):
+        nonlocal reply
+        state = session["state"]
+        user_data = session["data"]
+
+        if text.lower() in ["設定通勤", "start"]:
+            session["state"] = 'awaiting_origin'
+            session["data"] = {}
+            reply = "請輸入出發地"
+        elif state == 'awaiting_origin':
+            user_data['origin'] = text
+            session["state"] = 'awaiting_destination'
+            reply = "請輸入目的地"
+        elif state == 'awaiting_destination':
+            user_data['destination'] = text
+            session["state"] = 'awaiting_mode'
+            reply = "請選擇通勤方式：\n1. 大眾運輸\n2. 開車\n3. 步行\n4. 腳踏車\n請輸入數字（例如 1）"
+
+        elif state == 'awaiting_mode':
+            if text not in mode_map:
+                reply = "請輸入正確的數字（1~4）"
+            else:
+                user_data['mode'] = mode_map[text]
+                session["state"] = 'awaiting_time_type'
+                items = [
                     QuickReplyButton(action=PostbackAction(label="出發", data="select_departure")),
                     QuickReplyButton(action=PostbackAction(label="抵達", data="select_arrival")),
-                ])
-            )
-            line_bot_api.reply_message(event.reply_token, reply)
-            return
-    elif text == "切換到天氣查詢":
-         user_states[user_id] = 'awaiting_weather_location'
-         reply = "請輸入你想查詢天氣的地點"
-
-    elif state == 'awaiting_weather_location':
-        user_data[user_id] = {'weather_location': text}
-        user_states[user_id] = 'awaiting_weather_datetime'
+                ]
+                # 步行與腳踏車的通勤時間不隨出發時間變化，掃描只是多花查詢次數
+                if user_data['mode'] in SWEEP_MODES:
+                    items.append(QuickReplyButton(action=PostbackAction(label="找最佳出發時間", data="select_sweep")))
+                reply = TextSendMessage(
+                    text="請選擇你要設定的是『出發』還是『抵達』日期時間？",
+                    quick_reply=QuickReply(items=items)
+                )
+        elif text == "切換到天氣查詢":
+            session["state"] = 'awaiting_weather_location'
+            reply = "請輸入你想查詢天氣的地點"
 
-        now = time.strftime("%Y-%m-%dT%H:%M")
-        max_dt = time.strftime("%Y-%m-%dT%H:%M", time.localtime(time.time() + 60 * 60 * 24 * 30))
+        elif state == 'awaiting_weather_location':
+            session["data"] = {'weather_location': text}
+            session["state"] = 'awaiting_weather_datetime'
 
-        message = TextSendMessage(
-            text="請選擇你想查詢的日期與時間：",
-            quick_reply=QuickReply(items=[
-                QuickReplyButton(action=DatetimePickerAction(
-                    label="選擇時間",
-                    data="weather_datetime",
-                    mode="datetime",
-                    initial=now,
-                    min=now,
-                    max=max_dt
-                ))
-            ])
-        )
-        line_bot_api.reply_message(event.reply_token, message)
-        return
+            now = time.strftime("%Y-%m-%dT%H:%M")
+            max_dt = time.strftime("%Y-%m-%dT%H:%M", time.localtime(time.time() + 60 * 60 * 24 * 30))
 
-    else:
-        reply = "請輸入透過選單來開始設定"
+            reply = TextSendMessage(
+                text="請選擇你想查詢的日期與時間：",
+                quick_reply=QuickReply(items=[
+                    QuickReplyButton(action=DatetimePickerAction(
+                        label="選擇時間",
+                        data="weather_datetime",
+                        mode="datetime",
+                        initial=now,
+                        min=now,
+                        max=max_dt
+                    ))
+                ])
+            )
 
-    line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply))
+        else:
+            reply = "請輸入透過選單來開始設定"
+        return session
+
+    sessions.update(user_id, transition)
+    if isinstance(reply, str):
+        reply = TextSendMessage(text=reply)
+    reply_message(event, reply)
+
+# 選擇出發或抵達後，等待用戶選日期時間
+def select_time_type(time_type, session):
+    session["state"] = 'awaiting_datetime'
+    session["data"]['time_type'] = time_type
+    return session
+
+# 耗時查詢前讀到的 session 為 snapshot，查詢完只有在 session 仍與 snapshot 相同時才寫入結果，
+# 不覆蓋查詢期間其他事件（重新設定、再選一次時間）寫入的狀態；回傳是否寫入
+def replace_session(user_id, snapshot, session):
+    applied = False
+
+    def compare_and_set(current):
+        nonlocal applied
+        if current != snapshot:
+            return current
+        applied = True
+        return session
+
+    sessions.update(user_id, compare_and_set)
+    return applied
+
+# 找最佳出發時間：先選最早出發時間，再選範圍
+def select_sweep_start(session):
+    session["state"] = 'awaiting_sweep_start'
+    return session
+
+def set_sweep_start(start, session):
+    session["state"] = 'awaiting_sweep_window'
+    session["data"]['sweep_start'] = start
+    return session
+
+# 各取樣時間的通勤時間以長條表示，最短的標上星號
+def sweep_curve_text(curve, best_time):
+    shortest = min(minutes for _, minutes in curve)
+    longest = max(minutes for _, minutes in curve)
+    lines = []
+    for departure, minutes in curve:
+        bar = "▇" * (1 + round(7 * (minutes - shortest) / (longest - shortest)) if longest > shortest else 1)
+        mark = " ⭐" if departure == best_time else ""
+        lines.append(f"{departure} {bar} {minutes} 分{mark}")
+    return "\n".join(lines)
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
@@ -255,7 +252,8 @@ def handle_postback(event):
     if data == "weather_datetime":
         dt = params.get("datetime")  # 格式 '2025-06-05T08:30'
         if dt:
-            location = user_data[user_id]['weather_location']
+            snapshot = sessions.get(user_id)
+            location = snapshot["data"]['weather_location']
             dt_val = dt.replace("T", " ")
             city_district = get_city_and_district(location)
             weather_info = get_weather(city_district["city"], city_district["district"], dt)
@@ -266,13 +264,11 @@ def handle_postback(event):
 🕒 時間：{dt_val}
 🌤 天氣狀況：
 {weather_info}"""
-            user_states[user_id] = 'start'
-            user_data.pop(user_id, None)
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_msg))
+            replace_session(user_id, snapshot, new_session())
+            reply_message(event, TextSendMessage(text=reply_msg))
     
     elif data == "select_departure":
-        user_states[user_id] = 'awaiting_datetime'
-        user_data[user_id]['time_type'] = 'departure'
+        sessions.update(user_id, partial(select_time_type, 'departure'))
 
         message = TextSendMessage(
             text="請選擇出發日期與時間：",
@@ -287,11 +283,10 @@ def handle_postback(event):
                 ))
             ])
         )
-        line_bot_api.reply_message(event.reply_token, message)
+        reply_message(event, message)
 
     elif data == "select_arrival":
-        user_states[user_id] = 'awaiting_datetime'
-        user_data[user_id]['time_type'] = 'arrival'
+        sessions.update(user_id, partial(select_time_type, 'arrival'))
 
         message = TextSendMessage(
             text="請選擇抵達日期與時間：",
@@ -306,35 +301,136 @@ def handle_postback(event):
                 ))
             ])
         )
-        line_bot_api.reply_message(event.reply_token, message)
+        reply_message(event, message)
+
+    elif data == "select_sweep" and sessions.get(user_id)["data"].get('mode') not in SWEEP_MODES:
+        # 舊的快速回覆仍可能送來，步行與腳踏車不做掃描
+        reply_message(event, TextSendMessage(text="步行與腳踏車的通勤時間不受出發時間影響，請選擇出發或抵達時間。"))
+
+    elif data == "select_sweep":
+        sessions.update(user_id, select_sweep_start)
+
+        message = TextSendMessage(
+            text="請選擇最早可以出發的日期與時間：",
+            quick_reply=QuickReply(items=[
+                QuickReplyButton(action=DatetimePickerAction(
+                    label="選擇最早出發時間",
+                    data="sweep_start",
+                    mode="datetime",
+                    initial=now,
+                    min=now,
+                    max=max_dt
+                ))
+            ])
+        )
+        reply_message(event, message)
+
+    elif data == "sweep_start":
+        dt = params.get("datetime")
+        if dt:
+            sessions.update(user_id, partial(set_sweep_start, dt.replace("T", " ")))
+            message = TextSendMessage(
+                text="要在多久的範圍內找最佳出發時間？",
+                quick_reply=QuickReply(items=[
+                    QuickReplyButton(action=PostbackAction(label=f"{minutes // 60} 小時內", data=f"sweep_window={minutes}"))
+                    for minutes in SWEEP_WINDOWS
+                ])
+            )
+            reply_message(event, message)
+
+    elif data.startswith("sweep_window="):
+        snapshot = sessions.get(user_id)
+        user_data = dict(snapshot["data"])
+        minutes = int(data.split("=", 1)[1])
+        start = user_data['sweep_start']
+        end = time.strftime("%Y-%m-%d %H:%M", time.localtime(
+            time.mktime(time.strptime(start, "%Y-%m-%d %H:%M")) + minutes * 60
+        ))
+        result = get_departure_sweep(user_data['origin'], user_data['destination'], start, end, user_data['mode'])
+
+        if "error" in result:
+            reply_msg = f"""❌ 查詢失敗：{result['error']}
+━━━━━━━━━━━━━━
+請重新輸入「設定通勤」開始設定"""
+            replace_session(user_id, snapshot, new_session())
+        else:
+            best_time = result['best_departure_time'][-5:]
+            curve_text = sweep_curve_text(result['curve'], best_time)
+            reply_msg = f"""🕖 最佳出發時間
+━━━━━━━━━━━━━━
+📍 出發地：{user_data['origin']}
+🏁 目的地：{user_data['destination']}
+🚙 通勤方式：{MODE_DISPLAY[user_data['mode']]}
+🔎 出發時間範圍：{start}～{end[-5:]}
+🚪 最佳出發時間：{result['best_departure_time']}
+⏱ 預估通勤時間：{result['duration_text']}
+🏁 預計抵達時間：{result['estimated_arrival_time']}
+━━━━━━━━━━━━━━
+📈 各時段通勤時間：
+{curve_text}
+━━━━━━━━━━━━━━
+已依最佳出發時間設定通勤提醒"""
+            # 之後的提醒以最佳出發時間當作出發時間更新路況
+            user_data.pop('sweep_start', None)
+            user_data['time_type'] = 'departure'
+            user_data['datetime'] = result['best_departure_time']
+            if replace_session(user_id, snapshot, {"state": 'done', "data": user_data}):
+                reminder_scheduler.add(user_id, user_data, result)
+            else:
+                reply_msg = reply_msg.replace("已依最佳出發時間設定通勤提醒", SESSION_CHANGED_TEXT)
+        reply_message(event, TextSendMessage(text=reply_msg))
 
     elif data == "set_datetime":
         dt = params.get("datetime")  # 格式 '2025-06-05T08:30'
         if dt:
-            user_data[user_id]['datetime'] = dt.replace("T", " ")
-            dt_val = user_data[user_id]['datetime']
+            snapshot = sessions.get(user_id)
+            user_data = dict(snapshot["data"])
+            user_data['datetime'] = dt.replace("T", " ")
+            dt_val = user_data['datetime']
             # 新增 log
-            logger.info(f"用戶輸入 origins: {user_data[user_id]['origin']}, destinations: {user_data[user_id]['destination']}")
-            commute_result = get_commute_info(
-                user_data[user_id]['origin'],
-                user_data[user_id]['destination'],
-                dt_val,
-                user_data[user_id]['mode'],
-                user_data[user_id]['time_type']
-        )
-            commute_result = get_commute_info(
-                user_data[user_id]['origin'],
-                user_data[user_id]['destination'],
+            logger.info(f"用戶輸入 origins: {user_data['origin']}, destinations: {user_data['destination']}")
+            time_type = user_data['time_type']
+            dt_iso = dt_val.replace(" ", "T")
+
+            # 通勤、兩地行政區與天氣同時查詢；天氣只等它需要的結果，整體有回覆期限
+            def weather_task(time_key=None):
+                # time_key 為 None 時用用戶選的時間，否則取通勤結果中的對應時間
+                def task(info, commute=None):
+                    if time_key is None:
+                        when = dt_iso
+                    elif "error" in commute:
+                        return None
+                    else:
+                        when = commute[time_key].replace(" ", "T")
+                    return get_weather(info["city"], info["district"], when)
+                return task
+
+            graph = fanout.TaskGraph()
+            graph.add('commute', partial(
+                get_commute_info,
+                user_data['origin'],
+                user_data['destination'],
                 dt_val,
-                user_data[user_id]['mode'],
-                user_data[user_id]['time_type']
-            )
-            mode_display = {
-                'transit': '大眾運輸',
-                'driving': '開車',
-                'walking': '步行',
-                'bicycling': '腳踏車'
-            }
+                user_data['mode'],
+                time_type
+            ))
+            graph.add('origin_info', partial(get_city_and_district, user_data['origin']))
+            graph.add('dest_info', partial(get_city_and_district, user_data['destination']))
+            if time_type == 'departure':
+                graph.add('origin_weather', weather_task(), 'origin_info')
+                graph.add('dest_weather', weather_task('estimated_arrival_time'), 'dest_info', 'commute')
+            else:
+                graph.add('origin_weather', weather_task('best_departure_time'), 'origin_info', 'commute')
+                graph.add('dest_weather', weather_task(), 'dest_info')
+            if route_weather.ROUTE_WEATHER:
+                graph.add('route_weather', partial(
+                    route_weather.route_timeline,
+                    user_data['origin'],
+                    user_data['destination'],
+                    user_data['mode']
+                ), 'origin_info', 'dest_info', 'commute', optional=True)
+            results = graph.run(COMMUTE_REPLY_DEADLINE, optional_timeout=ROUTE_WEATHER_WAIT)
+            commute_result = results.get('commute') or {"error": "路線查詢逾時，請稍後再試"}
 
             if "error" in commute_result:
                 reply_msg = f"""❌ 設定失敗：{commute_result['error']}
@@ -345,50 +441,38 @@ def handle_postback(event):
 3. API 暫時故障
 
 請重新輸入「設定通勤」開始設定"""
-                user_states[user_id] = 'start'
-                user_data.pop(user_id, None)
+                replace_session(user_id, snapshot, new_session())
 
             else:
-                # 取得兩地經緯度與行政區
-                origin_info = get_city_and_district(user_data[user_id]['origin'])
-                dest_info = get_city_and_district(user_data[user_id]['destination'])
-
-                # 根據時間類型決定查詢時間點
-                if user_data[user_id]['time_type'] == 'departure':
-                    depart_time = dt_val.replace(" ", "T")
-                    arrival_time = commute_result['estimated_arrival_time'].replace(" ", "T")
-                else:
-                    depart_time = commute_result['best_departure_time'].replace(" ", "T")
-                    arrival_time = dt_val.replace(" ", "T")
-
-                # 判斷是否為相同縣市和區域
+                # 取得兩地經緯度與行政區，逾時的部分以未知處理
+                unknown = {"city": "未知縣市", "district": "未知鄉鎮區"}
+                origin_info = results.get('origin_info') or unknown
+                dest_info = results.get('dest_info') or unknown
+                origin_weather = results.get('origin_weather') or WEATHER_TIMEOUT_TEXT
+                dest_weather = results.get('dest_weather') or WEATHER_TIMEOUT_TEXT
+
+                # 判斷是否為相同縣市和區域，相同時只顯示出發時的天氣
                 same_location = (
                     origin_info["city"] == dest_info["city"] and
                     origin_info["district"] == dest_info["district"]
                 )
-
-                # 查詢天氣：如果地點相同，只查一次
                 if same_location:
-                    weather_info = get_weather(origin_info["city"], origin_info["district"], depart_time)
-                    origin_weather = dest_weather = weather_info
-                else:
-                    origin_weather = get_weather(origin_info["city"], origin_info["district"], depart_time)
-                    dest_weather = get_weather(dest_info["city"], dest_info["district"], arrival_time)
-                
+                    dest_weather = origin_weather
+
                 if same_location:
                     weather_section = f"🌤 天氣狀況：\n{origin_weather}"
                 else:
-                    if(user_data[user_id]['time_type'] == 'departure'):
+                    if(user_data['time_type'] == 'departure'):
                         weather_section = f"🌤 出發地天氣：\n{origin_weather}"
                     else:
                         weather_section = f"🌤 目的地天氣：\n{dest_weather}"
 
-                if user_data[user_id]['time_type'] == 'departure':
+                if user_data['time_type'] == 'departure':
                     reply_msg = f"""✅ 通勤提醒設定完成！
 ━━━━━━━━━━━━━━
-📍 出發地：{user_data[user_id]['origin']}
-🏁 目的地：{user_data[user_id]['destination']}
-🚙 通勤方式：{mode_display[user_data[user_id]['mode']]}
+📍 出發地：{user_data['origin']}
+🏁 目的地：{user_data['destination']}
+🚙 通勤方式：{MODE_DISPLAY[user_data['mode']]}
 🛣️ 總共里程：{commute_result['distance_text']}
 ⏰ 出發日期時間：{dt_val}
 {weather_section}
@@ -400,9 +484,9 @@ def handle_postback(event):
                 else:
                     reply_msg = f"""✅ 通勤提醒設定完成！
 ━━━━━━━━━━━━━━
-📍 出發地：{user_data[user_id]['origin']}
-🏁 目的地：{user_data[user_id]['destination']}
-🚙 通勤方式：{mode_display[user_data[user_id]['mode']]}
+📍 出發地：{user_data['origin']}
+🏁 目的地：{user_data['destination']}
+🚙 通勤方式：{MODE_DISPLAY[user_data['mode']]}
 🛣️ 總共里程：{commute_result['distance_text']}
 ⏰ 抵達日期時間：{dt_val}
 {weather_section}
@@ -411,18 +495,22 @@ def handle_postback(event):
 🚪 建議出發時間：{commute_result['best_departure_time']}
 ⏱ 預估通勤時間：{commute_result['duration_text']}
 {'' if same_location else f'🌤 出發地天氣：\n{origin_weather}'}"""
-                user_states[user_id] = 'done'
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=reply_msg))
+                # 有經過其他鄉鎮時附上沿途天氣
+                if results.get('route_weather'):
+                    reply_msg += "\n" + route_weather.format_timeline(results['route_weather'])
+                if replace_session(user_id, snapshot, {"state": 'done', "data": user_data}):
+                    reminder_scheduler.add(user_id, user_data, commute_result)
+                else:
+                    reply_msg = reply_msg.replace("✅ 通勤提醒設定完成！", "🔎 通勤查詢結果")
+                    reply_msg += "\n━━━━━━━━━━━━━━\n" + SESSION_CHANGED_TEXT
+            reply_message(event, TextSendMessage(text=reply_msg))
     else:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text="請重新選擇日期時間。"))
+        reply_message(event, TextSendMessage(text="請重新選擇日期時間。"))
 
 # 啟動服務
 if __name__ == "__main__":
-    # 建立 Rich Menu
-    rich_menu_id = line_bot_api.create_rich_menu(create_rich_menu())
-    with open("111.png", 'rb') as f:
-        line_bot_api.set_rich_menu_image(rich_menu_id, "image/jpeg", f)
-    line_bot_api.set_default_rich_menu(rich_menu_id)
+    # 同步 Rich Menu，內容沒變時不會建立新選單（gunicorn 部署由 gunicorn.conf.py 處理）
+    sync_rich_menu(line_bot_api)
     logger.info("啟動服務...")
     app.run(debug=True)
 
@@ -0,0 +1,79 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+ARRIVAL_TOLERANCE = int(os.getenv('ARRIVAL_TOLERANCE', 30))  # 抵達時間誤差在 30 秒內即視為收斂
+ARRIVAL_MAX_ROUNDS = int(os.getenv('ARRIVAL_MAX_ROUNDS', 4))
+ARRIVAL_PROBES = int(os.getenv('ARRIVAL_PROBES', 2))  # 每一輪同時查詢的候選出發時間數
+
+_executor = ThreadPoolExecutor(max_workers=max(ARRIVAL_PROBES, 4), thread_name_prefix="arrival")
+
+
+# 求出發時間 d 使 d + f(d) = arrival，其中 f 為 evaluate(d) 回傳的通勤秒數。
+# 每一輪以定點迭代、割線法與夾擠區間產生候選點並同時查詢，回傳誤差最小的結果。
+def solve(evaluate, arrival, initial_guesses=None, tolerance=ARRIVAL_TOLERANCE,
+          max_rounds=ARRIVAL_MAX_ROUNDS, probes=ARRIVAL_PROBES):
+    evaluated = {}  # 出發時間 -> (通勤秒數, 原始資料)
+    candidates = list(initial_guesses or [arrival - 3600])
+    rounds = 0
+
+    def error(departure):
+        return departure + evaluated[departure][0] - arrival
+
+    while candidates and rounds < max_rounds:
+        rounds += 1
+        results = _executor.map(evaluate, candidates)
+        for departure, result in zip(candidates, results):
+            evaluated[departure] = result
+
+        best = min(evaluated, key=lambda d: abs(error(d)))
+        if abs(error(best)) < tolerance:
+            break
+        candidates = _next_candidates(evaluated, error, arrival, best, tolerance, probes)
+
+    best = min(evaluated, key=lambda d: abs(error(d)))
+    duration, detail = evaluated[best]
+    return {
+        "departure": best,
+        "duration": duration,
+        "detail": detail,
+        "rounds": rounds,
+        "evaluations": len(evaluated),
+    }
+
+
+def _next_candidates(evaluated, error, arrival, best, tolerance, probes):
+    # 定點迭代：以目前最佳點的通勤時間反推
+    fixed_point = arrival - evaluated[best][0]
+    proposals = []
+
+    early = [d for d in evaluated if error(d) < 0]
+    late = [d for d in evaluated if error(d) > 0]
+    if early and late and min(late) > max(early):
+        # 已夾住答案：在最接近的兩端之間做割線（regula falsi），定點落在區間外就改用中點
+        lo, hi = max(early), min(late)
+        proposals.append(_secant(lo, hi, error(lo), error(hi)))
+        proposals.append(fixed_point if lo < fixed_point < hi else (lo + hi) // 2)
+        proposals.append((lo + hi) // 2)
+    else:
+        proposals.append(fixed_point)
+        others = sorted((d for d in evaluated if d != best), key=lambda d: abs(error(d)))
+        if others and error(others[0]) != error(best):
+            proposals.append(_secant(best, others[0], error(best), error(others[0])))
+        # 已有兩點仍未夾住答案時，往反方向多探一點，盡快形成夾擠區間
+        if others:
+            step = tolerance * 10
+            proposals.append(fixed_point - step if error(best) > 0 else fixed_point + step)
+
+    candidates = []
+    for departure in proposals:
+        departure = int(departure)
+        if any(abs(departure - d) < tolerance for d in list(evaluated) + candidates):
+            continue
+        candidates.append(departure)
+        if len(candidates) >= probes:
+            break
+    return candidates
+
+
+def _secant(x0, x1, y0, y1):
+    return x0 - y0 * (x1 - x0) / (y1 - y0)
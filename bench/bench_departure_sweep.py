@@ -0,0 +1,59 @@
+import sys
+import math
+import random
+import argparse
+
+import departure_sweep
+
+# 以模擬的尖峰路況曲線比較出發時間掃描與逐格查詢：查詢次數與找到的通勤時間差距
+# 用法：python -m bench.bench_departure_sweep [--cases 500] [--window 180]
+
+
+# 基本車程加上一到兩個尖峰（高斯曲線）與少量雜訊，單位為秒
+def traffic_curve(rng, start):
+    base = rng.randint(900, 3600)
+    peaks = [(start + rng.randint(0, 4 * 3600), rng.randint(600, 3600), base * rng.uniform(0.2, 1.2))
+             for _ in range(rng.randint(1, 2))]
+    noise = {}
+
+    def duration(departure):
+        if departure not in noise:
+            noise[departure] = rng.uniform(-30, 30)
+        value = base + sum(h * math.exp(-((departure - c) / w) ** 2) for c, w, h in peaks)
+        return int(value + noise[departure])
+
+    return duration
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=500)
+    parser.add_argument("--window", type=int, default=180, help="出發時間範圍（分鐘）")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    step = departure_sweep.SWEEP_STEP_MINUTES * 60
+    start = 7 * 3600
+    end = start + args.window * 60
+    slots = list(range(start, end + 1, step))
+
+    calls, gaps, exact = [], [], 0
+    for _ in range(args.cases):
+        duration = traffic_curve(rng, start - 3600)
+        result = departure_sweep.sweep(lambda d: (duration(d), None), start, end, step)
+        optimum = min(duration(d) for d in slots)
+        calls.append(result["evaluations"])
+        gaps.append(result["duration"] - optimum)
+        exact += result["duration"] == optimum
+
+    gaps.sort()
+    print(f"{args.cases} 組路況，{len(slots)} 個候選出發時間（每 {step // 60} 分鐘）")
+    print(f"逐格查詢：每次 {len(slots)} 次")
+    print(f"掃描：平均 {sum(calls) / len(calls):.1f} 次，最多 {max(calls)} 次")
+    print(f"找到最短時間的比例：{exact / args.cases:.1%}")
+    print(f"與最短時間的差距：p50 {gaps[len(gaps) // 2]} 秒，p95 {gaps[int(len(gaps) * 0.95)]} 秒，最大 {gaps[-1]} 秒")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
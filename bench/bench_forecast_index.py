@@ -0,0 +1,77 @@
+import sys
+import argparse
+import timeit
+from datetime import datetime, timedelta
+
+from forecast_index import ForecastIndex
+from bench.cwa_payload import build_payload, load_payload
+
+# 比較原本逐筆掃描與 bisect 索引查詢的耗時
+# 用法：python -m bench.bench_forecast_index [--payload F-D0047-007.json]
+
+RENDERED = {
+    "天氣現象": "Weather",
+    "最低溫度": "MinTemperature",
+    "最高溫度": "MaxTemperature",
+    "最低體感溫度": "MinApparentTemperature",
+    "最高體感溫度": "MaxApparentTemperature",
+    "12小時降雨機率": "ProbabilityOfPrecipitation",
+    "紫外線指數": "UVIndex",
+}
+
+
+# 舊版 get_weather 的巢狀迴圈（每筆都重新解析時間）
+def legacy_lookup(data, district, target_time):
+    found = {}
+    for location in data["records"]["Locations"]:
+        for loc in location["Location"]:
+            if loc["LocationName"] != district:
+                continue
+            for element in loc["WeatherElement"]:
+                for entry in element["Time"]:
+                    start = datetime.fromisoformat(entry["StartTime"].replace("+08:00", ""))
+                    end = datetime.fromisoformat(entry["EndTime"].replace("+08:00", ""))
+                    if not (start <= target_time < end):
+                        continue
+                    key = RENDERED.get(element["ElementName"])
+                    if key:
+                        found[element["ElementName"]] = entry["ElementValue"][0].get(key)
+    return found
+
+
+def indexed_lookup(index, district, target_time):
+    found = {}
+    for name, key in RENDERED.items():
+        value = index.value_at(district, name, target_time)
+        if value:
+            found[name] = value.get(key)
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payload", help="錄下的 F-D0047 回應 JSON 檔")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    data = load_payload(args.payload) if args.payload else build_payload()
+    locations = data["records"]["Locations"][0]["Location"]
+    district = locations[len(locations) // 2]["LocationName"]
+    first = locations[0]["WeatherElement"][0]["Time"][0]["StartTime"]
+    target_time = datetime.fromisoformat(first.replace("+08:00", "")) + timedelta(days=2, hours=3)
+
+    index = ForecastIndex(data)
+    assert legacy_lookup(data, district, target_time) == indexed_lookup(index, district, target_time)
+
+    build = min(timeit.repeat(lambda: ForecastIndex(data), number=10, repeat=3)) / 10
+    legacy = min(timeit.repeat(lambda: legacy_lookup(data, district, target_time), number=args.number, repeat=3)) / args.number
+    indexed = min(timeit.repeat(lambda: indexed_lookup(index, district, target_time), number=args.number, repeat=3)) / args.number
+
+    print(f"資料集：{len(locations)} 個鄉鎮，查詢 {district} @ {target_time}")
+    print(f"建立索引（每次更新一次）：{build * 1e3:8.3f} ms")
+    print(f"逐筆掃描查詢：          {legacy * 1e6:8.1f} µs")
+    print(f"bisect 索引查詢：       {indexed * 1e6:8.1f} µs  ({legacy / indexed:.0f}x)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import timeit
+import tracemalloc
+from datetime import timedelta
+
+import cwa_registry
+import forecast_snapshot
+from forecast_index import ForecastIndex
+from bench.cwa_payload import build_payload, _default_start
+
+# 全臺 22 縣市 × 3 天 / 一週預報全部留在記憶體時的用量，以及快照寫入、mmap 載入與查詢的耗時
+# 用法：python -m bench.bench_forecast_memory [--all-elements]
+
+TOWNSHIPS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "townships.json")
+
+
+def island_payloads(all_elements=False):
+    with open(TOWNSHIPS_PATH, encoding="utf-8") as f:
+        townships = json.load(f)
+    payloads = {}
+    for city, (three_day, weekly) in cwa_registry.CWA_DATASETS.items():
+        for dataset_id, is_three_day in ((three_day, True), (weekly, False)):
+            product = cwa_registry.THREE_DAY if is_three_day else cwa_registry.WEEKLY
+            names = None if all_elements else cwa_registry.PRODUCT_ELEMENTS[product]
+            # 經過 JSON 序列化再解析，記憶體用量才與實際收到的回應相同
+            payload = build_payload(dataset_id, city, townships[city], seed=len(payloads),
+                                    three_day=is_three_day, element_names=names)
+            payloads[dataset_id] = json.loads(json.dumps(payload, ensure_ascii=False))
+    return payloads
+
+
+def measure(build):
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--all-elements", action="store_true", help="保留資料集的所有天氣因子（預設只取會用到的）")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    raw, raw_size = measure(lambda: island_payloads(args.all_elements))
+    indexes, index_size = measure(lambda: {dataset_id: ForecastIndex(data) for dataset_id, data in raw.items()})
+
+    path = os.path.join(tempfile.mkdtemp(prefix="forecast-snapshot-"), "forecast_snapshot.bin")
+    datasets = {dataset_id: (index, 0.0) for dataset_id, index in indexes.items()}
+    dump = min(timeit.repeat(lambda: forecast_snapshot.dump(datasets, path), number=1, repeat=3))
+    loaded, mapped_size = measure(lambda: forecast_snapshot.load(path))
+    load = min(timeit.repeat(lambda: forecast_snapshot.load(path), number=1, repeat=3))
+
+    # 快照載回的索引查詢結果必須與原本相同
+    dataset_id = cwa_registry.dataset_id("桃園市", cwa_registry.WEEKLY)
+    target_time = _default_start(12) + timedelta(days=2, hours=3)
+    original, mapped = indexes[dataset_id], loaded[dataset_id][0]
+    for district in original.districts():
+        for element in original.elements(district):
+            assert original.value_at(district, element, target_time) == mapped.value_at(district, element, target_time)
+
+    district = original.districts()[0]
+    lookup = min(timeit.repeat(lambda: original.value_at(district, "天氣現象", target_time),
+                               number=args.number, repeat=3)) / args.number
+    mapped_lookup = min(timeit.repeat(lambda: mapped.value_at(district, "天氣現象", target_time),
+                                      number=args.number, repeat=3)) / args.number
+
+    towns = sum(len(index.districts()) for index in indexes.values())
+    print(f"{len(raw)} 個資料集，共 {towns} 個鄉鎮序列組")
+    print(f"原始 JSON 解析結果：   {raw_size / 2 ** 20:8.2f} MB")
+    print(f"ForecastIndex：        {index_size / 2 ** 20:8.2f} MB")
+    print(f"mmap 快照（行程記憶體）：{mapped_size / 2 ** 20:6.2f} MB，檔案 {os.path.getsize(path) / 2 ** 20:.2f} MB")
+    print(f"寫入快照：{dump * 1e3:8.1f} ms，mmap 載入：{load * 1e3:8.1f} ms")
+    print(f"查詢：記憶體 {lookup * 1e6:6.2f} µs，mmap {mapped_lookup * 1e6:6.2f} µs")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+import json
+import random
+from datetime import datetime, timedelta
+
+# 依 CWA F-D0047 鄉鎮預報（一週 / 3 天）的欄位結構產生固定內容的縣市資料集，
+# 離線壓測與基準測試時代替真實回應（可用 --payload 換成實際錄下的 JSON）
+
+TAOYUAN_DISTRICTS = [
+    "桃園區", "中壢區", "平鎮區", "八德區", "楊梅區", "蘆竹區", "大溪區",
+    "龍潭區", "龜山區", "大園區", "觀音區", "新屋區", "復興區",
+]
+
+WEATHERS = ["晴", "多雲", "陰", "多雲時陰", "陰短暫雨", "多雲午後短暫雷陣雨"]
+
+# 天氣因子名稱 -> 產生 ElementValue 的函式
+ELEMENTS = {
+    "平均溫度": lambda r: {"Temperature": str(r.randint(18, 32))},
+    "最高溫度": lambda r: {"MaxTemperature": str(r.randint(26, 35))},
+    "最低溫度": lambda r: {"MinTemperature": str(r.randint(18, 25))},
+    "平均露點溫度": lambda r: {"DewPoint": str(r.randint(15, 25))},
+    "平均相對濕度": lambda r: {"RelativeHumidity": str(r.randint(60, 95))},
+    "最高體感溫度": lambda r: {"MaxApparentTemperature": str(r.randint(28, 40))},
+    "最低體感溫度": lambda r: {"MinApparentTemperature": str(r.randint(18, 26))},
+    "最大舒適度指數": lambda r: {"MaxComfortIndex": str(r.randint(20, 30)), "MaxComfortIndexDescription": "舒適"},
+    "最小舒適度指數": lambda r: {"MinComfortIndex": str(r.randint(15, 25)), "MinComfortIndexDescription": "舒適"},
+    "風速": lambda r: {"WindSpeed": str(r.randint(1, 6)), "BeaufortScale": str(r.randint(1, 4))},
+    "風向": lambda r: {"WindDirection": r.choice(["偏北風", "偏南風", "西北風"])},
+    "12小時降雨機率": lambda r: {"ProbabilityOfPrecipitation": str(r.choice([0, 10, 20, 30, 60, 80]))},
+    "天氣現象": lambda r: {"Weather": r.choice(WEATHERS), "WeatherCode": f"{r.randint(1, 20):02d}"},
+    "紫外線指數": lambda r: {"UVIndex": str(r.randint(1, 11)), "UVExposureLevel": r.choice(["低量級", "中量級", "高量級", "過量級"])},
+    "天氣預報綜合描述": lambda r: {"WeatherDescription": "多雲。降雨機率 20%。溫度攝氏24至31度。舒適至悶熱。"},
+}
+
+
+# 3 天預報：溫度類為逐時的 DataTime，其餘為 3 小時一段
+THREE_DAY_POINT_ELEMENTS = {
+    "溫度": lambda r: {"Temperature": str(r.randint(18, 32))},
+    "露點溫度": lambda r: {"DewPoint": str(r.randint(15, 25))},
+    "相對濕度": lambda r: {"RelativeHumidity": str(r.randint(60, 95))},
+    "體感溫度": lambda r: {"ApparentTemperature": str(r.randint(18, 36))},
+    "舒適度指數": lambda r: {"ComfortIndex": str(r.randint(15, 30)), "ComfortIndexDescription": "舒適"},
+    "風速": lambda r: {"WindSpeed": str(r.randint(1, 6)), "BeaufortScale": str(r.randint(1, 4))},
+    "風向": lambda r: {"WindDirection": r.choice(["偏北風", "偏南風", "西北風"])},
+}
+THREE_DAY_SLOT_ELEMENTS = {
+    "3小時降雨機率": lambda r: {"ProbabilityOfPrecipitation": str(r.choice([0, 10, 20, 30, 60, 80]))},
+    "天氣現象": ELEMENTS["天氣現象"],
+    "天氣預報綜合描述": ELEMENTS["天氣預報綜合描述"],
+}
+
+
+def _slots(start, count, hours):
+    for i in range(count):
+        begin = start + timedelta(hours=hours * i)
+        yield begin, begin + timedelta(hours=hours)
+
+
+def _fmt(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%S+08:00")
+
+
+def _default_start(hours):
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    if hours == 12:
+        # 一週預報以 06 / 18 時為分段
+        if 6 <= now.hour < 18:
+            return now.replace(hour=6)
+        start = now.replace(hour=18)
+        return start if now.hour >= 18 else start - timedelta(days=1)
+    return now - timedelta(hours=now.hour % hours)
+
+
+def build_payload(dataset_id="F-D0047-007", city="桃園市", districts=TAOYUAN_DISTRICTS,
+                  start=None, seed=0, three_day=False, element_names=None):
+    rnd = random.Random(seed)
+    if start is None:
+        start = _default_start(3 if three_day else 12)
+    wanted = set(element_names) if element_names else None
+
+    locations = []
+    for district in districts:
+        elements = []
+        if three_day:
+            for name, make in THREE_DAY_POINT_ELEMENTS.items():
+                times = [{"DataTime": _fmt(begin), "ElementValue": [make(rnd)]} for begin, _ in _slots(start, 72, 1)]
+                elements.append({"ElementName": name, "Time": times})
+            for name, make in THREE_DAY_SLOT_ELEMENTS.items():
+                times = [{"StartTime": _fmt(begin), "EndTime": _fmt(end), "ElementValue": [make(rnd)]}
+                         for begin, end in _slots(start, 24, 3)]
+                elements.append({"ElementName": name, "Time": times})
+        else:
+            for name, make in ELEMENTS.items():
+                times = []
+                for begin, end in _slots(start, 14, 12):
+                    # 紫外線只在白天時段提供
+                    if name == "紫外線指數" and begin.hour != 6:
+                        continue
+                    times.append({"StartTime": _fmt(begin), "EndTime": _fmt(end), "ElementValue": [make(rnd)]})
+                elements.append({"ElementName": name, "Time": times})
+        if wanted is not None:
+            elements = [element for element in elements if element["ElementName"] in wanted]
+        locations.append({
+            "LocationName": district, "Geocode": "", "Latitude": "24.99", "Longitude": "121.30",
+            "WeatherElement": elements,
+        })
+
+    return {
+        "success": "true",
+        "result": {"resource_id": dataset_id, "fields": []},
+        "records": {"Locations": [{
+            "DatasetDescription": "臺灣各鄉鎮市區預報資料-" + ("3天天氣預報" if three_day else "一週天氣預報"),
+            "LocationsName": city,
+            "Dataid": dataset_id,
+            "Location": locations,
+        }]},
+    }
+
+
+def load_payload(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
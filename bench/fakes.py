@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import threading
+import zlib
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import cwa_registry
+from bench.cwa_payload import build_payload
+
+# 離線壓測用的假上游：Nominatim、CWA、Google Distance Matrix / Directions 與 LINE 訊息 API。
+# 回應依錄下的格式產生，並可設定每次回應的延遲。
+
+# 地名 -> Nominatim 回應中的 address 欄位與座標
+PLACES = {
+    "桃園高鐵站": ("桃園市", "中壢區", "25.0129", "121.2150"),
+    "中壢火車站": ("桃園市", "中壢區", "24.9537", "121.2256"),
+    "桃園火車站": ("桃園市", "桃園區", "24.9891", "121.3136"),
+    "台北車站": ("臺北市", "中正區", "25.0478", "121.5170"),
+    "台北101": ("臺北市", "信義區", "25.0340", "121.5645"),
+    "南港展覽館": ("臺北市", "南港區", "25.0553", "121.6175"),
+    "板橋車站": ("新北市", "板橋區", "25.0143", "121.4637"),
+    "新竹科學園區": ("新竹市", "東區", "24.7808", "121.0057"),
+    "台中火車站": ("臺中市", "中區", "24.1372", "120.6866"),
+    "高雄車站": ("高雄市", "三民區", "22.6394", "120.3025"),
+}
+
+# 桃園到臺北之間以經度切成數個鄉鎮的簡化界線，讓沿途天氣在壓測與 smoke 測試中也會執行
+BOUNDARIES_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "town_boundaries.json")
+
+CITY_DISTRICTS = {}
+for _city, _district, _, _ in PLACES.values():
+    CITY_DISTRICTS.setdefault(_city, set()).add(_district)
+with open(BOUNDARIES_FIXTURE, encoding="utf-8") as _f:
+    for _feature in json.load(_f)["features"]:
+        _properties = _feature["properties"]
+        CITY_DISTRICTS.setdefault(_properties["COUNTYNAME"], set()).add(_properties["TOWNNAME"])
+
+DATASET_CITIES = {}
+for _city, _datasets in cwa_registry.CWA_DATASETS.items():
+    for _dataset in _datasets:
+        DATASET_CITIES[_dataset] = _city
+
+
+def nominatim_response(query):
+    place = PLACES.get(query)
+    if place is None:
+        return []
+    city, district, lat, lon = place
+    return [{
+        "lat": lat, "lon": lon, "display_name": f"{query}, {district}, {city}, 臺灣",
+        "address": {"suburb": district, "city": city, "country": "臺灣", "country_code": "tw"},
+    }]
+
+
+def cwa_response(dataset, element_names=None):
+    city = DATASET_CITIES.get(dataset, "桃園市")
+    districts = sorted(CITY_DISTRICTS.get(city, {"中壢區"}))
+    three_day = dataset in DATASET_CITIES and cwa_registry.product_of(dataset) == cwa_registry.THREE_DAY
+    return build_payload(dataset, city, districts, three_day=three_day, element_names=element_names)
+
+
+# 通勤時間：依起訖點決定基本車程，早晚尖峰加成
+def distance_matrix_response(params):
+    origin, destination = params.get("origins", ""), params.get("destinations", "")
+    seed = zlib.crc32(f"{origin}|{destination}".encode())
+    base = 600 + seed % 3000
+    when = int(params.get("departure_time") or params.get("arrival_time") or time.time())
+    hour = datetime.fromtimestamp(when).hour
+    rush = 1.4 if hour in (7, 8, 17, 18) else 1.0
+    duration = int(base * rush)
+    element = {
+        "status": "OK",
+        "distance": {"text": f"{base * 12 / 1000:.1f} 公里", "value": base * 12},
+        "duration": {"text": f"{base // 60} 分", "value": base},
+    }
+    if params.get("mode") == "driving":
+        element["duration_in_traffic"] = {"text": f"{duration // 60} 分", "value": duration}
+    return {
+        "status": "OK",
+        "origin_addresses": [origin], "destination_addresses": [destination],
+        "rows": [{"elements": [element]}],
+    }
+
+
+def _encode_polyline(points):
+    encoded, last = [], (0, 0)
+    for lat, lon in points:
+        current = (round(lat * 1e5), round(lon * 1e5))
+        for delta in (current[0] - last[0], current[1] - last[1]):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                encoded.append(chr((0x20 | (value & 0x1f)) + 63))
+                value >>= 5
+            encoded.append(chr(value + 63))
+        last = current
+    return "".join(encoded)
+
+
+# 路線：起訖點之間的直線切成數個路段，總耗時與 Distance Matrix 的基本車程相同
+def directions_response(params):
+    origin, destination = params.get("origin", ""), params.get("destination", "")
+    if origin not in PLACES or destination not in PLACES:
+        return {"status": "NOT_FOUND", "routes": []}
+    start = tuple(map(float, PLACES[origin][2:]))
+    end = tuple(map(float, PLACES[destination][2:]))
+    base = 600 + zlib.crc32(f"{origin}|{destination}".encode()) % 3000
+    count = 4
+    points = [(start[0] + (end[0] - start[0]) * i / count, start[1] + (end[1] - start[1]) * i / count)
+              for i in range(count + 1)]
+    steps = [{
+        "duration": {"value": base // count},
+        "polyline": {"points": _encode_polyline(points[i:i + 2])},
+    } for i in range(count)]
+    return {"status": "OK", "routes": [{"legs": [{"steps": steps}]}]}
+
+
+class FakeUpstreams:
+    def __init__(self, latency=None):
+        self.latency = latency or {}  # 服務名稱 -> 秒
+        self.calls = Counter()  # 處理請求的執行緒同時更新，以 _calls_lock 保護
+        self.replies = {}  # reply token -> 收到的時間
+        self.pushes = defaultdict(deque)  # 用戶 -> 尚未被讀取的 push 時間，依收到順序
+        self._calls_lock = threading.Lock()
+        self._reply_event = threading.Condition()
+        self._server = None
+
+    def start(self, host="127.0.0.1", port=0):
+        upstreams = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                upstreams._handle(self, "GET")
+
+            def do_POST(self):
+                upstreams._handle(self, "POST")
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    # 等待某個 reply token 被回覆，回傳回覆時間（逾時回傳 None）。
+    # 有傳 push_to 時，該用戶收到的 push 也算回覆（reply token 過期改用 push）；每筆 push 只會被取走一次
+    def wait_reply(self, token, timeout=30, push_to=None):
+        with self._reply_event:
+            self._reply_event.wait_for(lambda: token in self.replies or self.pushes.get(push_to), timeout)
+            if token in self.replies:
+                return self.replies[token]
+            if self.pushes.get(push_to):
+                return self.pushes[push_to].popleft()
+            return None
+
+    def _handle(self, request, method):
+        parsed = urlparse(request.path)
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        body = b""
+        if method == "POST":
+            body = request.rfile.read(int(request.headers.get("Content-Length") or 0))
+
+        path = parsed.path
+        reply_token = push_to = None
+        if path == "/search":
+            name, payload = "nominatim", nominatim_response(query.get("q", ""))
+        elif path.startswith("/api/v1/rest/datastore/"):
+            names = query.get("ElementName")
+            name = "cwa"
+            payload = cwa_response(path.rsplit("/", 1)[1], names.split(",") if names else None)
+        elif path == "/maps/api/distancematrix/json":
+            name, payload = "google", distance_matrix_response(query)
+        elif path == "/maps/api/directions/json":
+            name, payload = "google_directions", directions_response(query)
+        elif path.startswith("/v2/bot/message/"):
+            name, payload = "line_" + path.rsplit("/", 1)[1], {}
+            message = json.loads(body or b"{}")
+            reply_token = message.get("replyToken")
+            push_to = message.get("to")
+        elif path.startswith("/v2/bot/richmenu"):
+            name, payload = "line_richmenu", {"richMenuId": "richmenu-bench"}
+        else:
+            request.send_error(404)
+            return
+
+        with self._calls_lock:
+            self.calls[name] += 1
+        delay = self.latency.get(name.split("_")[0], 0)
+        if delay:
+            time.sleep(delay)
+        # 回覆以 reply token 記錄；push 依用戶排隊，等待端讀取後移除
+        if reply_token is not None or push_to is not None:
+            with self._reply_event:
+                if reply_token is not None:
+                    self.replies[reply_token] = time.perf_counter()
+                else:
+                    self.pushes[push_to].append(time.perf_counter())
+                self._reply_event.notify_all()
+
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        request.send_response(200)
+        request.send_header("Content-Type", "application/json; charset=utf-8")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import hmac
+import base64
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+import itertools
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from bench.fakes import FakeUpstreams, PLACES, BOUNDARIES_FIXTURE
+
+# 離線壓測：啟動假上游與 app，模擬多位用戶走完天氣查詢與通勤設定流程
+# 用法：python -m bench.loadtest [--users 50] [--flows 4] [--latency cwa=0.2,google=0.3] [--redelivery 0.2]
+
+CHANNEL_SECRET = "loadtest-secret"
+WEATHER_FLOW = "weather"
+COMMUTE_FLOW = "commute"
+
+_tokens = itertools.count(1)
+
+
+def parse_latency(text):
+    latency = {}
+    for item in filter(None, (text or "").split(",")):
+        name, seconds = item.split("=")
+        latency[name.strip()] = float(seconds)
+    return latency
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    rank = min(len(values) - 1, max(0, int(round(pct / 100 * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def sign(body, secret=CHANNEL_SECRET):
+    digest = hmac.new(secret.encode(), body.encode(), hashlib.sha256).digest()
+    return base64.b64encode(digest).decode()
+
+
+def _event(user_id, kind, payload):
+    event = {
+        "type": kind,
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "source": {"type": "user", "userId": user_id},
+        "webhookEventId": f"01LOADTEST{next(_tokens):016d}",
+        "deliveryContext": {"isRedelivery": False},
+        "replyToken": f"reply-{next(_tokens)}",
+    }
+    event.update(payload)
+    return event
+
+
+def text_event(user_id, text):
+    return _event(user_id, "message", {"message": {"id": str(next(_tokens)), "type": "text", "text": text}})
+
+
+def postback_event(user_id, data, when=None):
+    postback = {"data": data}
+    if when is not None:
+        postback["params"] = {"datetime": when}
+    return _event(user_id, "postback", {"postback": postback})
+
+
+# 一位虛擬用戶：每一步送出簽好章的 Webhook，等 LINE 假伺服器收到回覆再送下一步
+class VirtualUser:
+    def __init__(self, index, base_url, fakes, stats, rng, redelivery=0.0):
+        self.user_id = f"U{index:032x}"
+        self.redelivery = redelivery
+        self.base_url = base_url
+        self.fakes = fakes
+        self.stats = stats
+        self.rng = rng
+        self.http = requests.Session()
+
+    def post(self, event):
+        body = json.dumps({"destination": "Ubench", "events": [event]}, ensure_ascii=False)
+        return self.http.post(
+            f"{self.base_url}/callback", data=body.encode(),
+            headers={"Content-Type": "application/json", "X-Line-Signature": sign(body)}
+        )
+
+    def send(self, step, event):
+        started = time.perf_counter()
+        response = self.post(event)
+        self.stats.record(f"{step} webhook", time.perf_counter() - started, response.status_code)
+        replied = self.fakes.wait_reply(event["replyToken"], push_to=self.user_id)
+        if replied is None:
+            self.stats.record(f"{step} 回覆", None, "timeout")
+        else:
+            self.stats.record(f"{step} 回覆", replied - started, 200)
+        # 模擬 LINE 重送同一事件（相同 webhookEventId），應該只花一次查詢而不再回覆
+        if self.rng.random() < self.redelivery:
+            event = dict(event, deliveryContext={"isRedelivery": True})
+            started = time.perf_counter()
+            response = self.post(event)
+            self.stats.record("重送 webhook", time.perf_counter() - started, response.status_code)
+
+    def weather_flow(self):
+        when = self.when()
+        self.send("天氣:選單", text_event(self.user_id, "切換到天氣查詢"))
+        self.send("天氣:地點", text_event(self.user_id, self.rng.choice(list(PLACES))))
+        self.send("天氣:時間", postback_event(self.user_id, "weather_datetime", when))
+
+    def commute_flow(self):
+        origin, destination = self.rng.sample(list(PLACES), 2)
+        self.send("通勤:開始", text_event(self.user_id, "設定通勤"))
+        self.send("通勤:出發地", text_event(self.user_id, origin))
+        self.send("通勤:目的地", text_event(self.user_id, destination))
+        self.send("通勤:方式", text_event(self.user_id, "2"))
+        choice = self.rng.choice(["select_departure", "select_arrival", "select_sweep"])
+        self.send("通勤:出發或抵達", postback_event(self.user_id, choice))
+        if choice == "select_sweep":
+            self.send("通勤:最早出發", postback_event(self.user_id, "sweep_start", self.when()))
+            self.send("通勤:範圍", postback_event(self.user_id, f"sweep_window={self.rng.choice([60, 120, 180])}"))
+        else:
+            self.send("通勤:時間", postback_event(self.user_id, "set_datetime", self.when()))
+
+    # 查詢時間落在未來三天內，整點或半點
+    def when(self):
+        target = datetime.now() + timedelta(hours=self.rng.randint(1, 60))
+        return target.replace(minute=self.rng.choice([0, 30]), second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M")
+
+    def run(self, flows, weather_ratio):
+        for _ in range(flows):
+            started = time.perf_counter()
+            if self.rng.random() < weather_ratio:
+                flow = WEATHER_FLOW
+                self.weather_flow()
+            else:
+                flow = COMMUTE_FLOW
+                self.commute_flow()
+            self.stats.record(f"流程:{flow}", time.perf_counter() - started, 200)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, status):
+        with self._lock:
+            if seconds is not None:
+                self.latencies[name].append(seconds)
+            self.statuses[name][status] += 1
+
+    def report(self, elapsed, calls):
+        lines = [f"{'項目':<16}{'次數':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  狀態"]
+        for name in sorted(self.statuses):
+            values = self.latencies[name]
+            status = ", ".join(f"{k}:{v}" for k, v in sorted(self.statuses[name].items(), key=str))
+            lines.append(
+                f"{name:<16}{len(values):>8}"
+                f"{percentile(values, 50) * 1000:>10.1f}{percentile(values, 95) * 1000:>10.1f}"
+                f"{percentile(values, 99) * 1000:>10.1f}{max(values, default=0) * 1000:>10.1f}  {status}"
+            )
+        webhooks = sum(len(v) for k, v in self.latencies.items() if k.endswith("webhook"))
+        flows = sum(len(v) for k, v in self.latencies.items() if k.startswith("流程:"))
+        lines.append("")
+        lines.append(f"耗時 {elapsed:.2f} 秒：{webhooks / elapsed:.1f} webhook/秒，{flows / elapsed:.2f} 流程/秒")
+        lines.append("上游呼叫次數：" + ", ".join(f"{k}={v}" for k, v in sorted(calls.items())))
+        if flows:
+            upstream = sum(v for k, v in calls.items() if not k.startswith("line"))
+            lines.append(f"平均每個流程 {upstream / flows:.2f} 次 Nominatim/CWA/Google 呼叫")
+        return "\n".join(lines)
+
+
+# 在匯入 app 之前把所有上游指向假伺服器，並使用暫存的資料庫
+def configure_env(fakes_url, workdir):
+    os.environ.update({
+        "NOMINATIM_URL": fakes_url,
+        "CWA_URL": fakes_url,
+        "GOOGLE_URL": fakes_url,
+        "LINE_API_ENDPOINT": fakes_url,
+        "LINE_CHANNEL_SECRET": CHANNEL_SECRET,
+        "LINE_CHANNEL_ACCESS_TOKEN": "loadtest-token",
+        "CWB_API_KEY": "loadtest",
+        "GOOGLE_API_KEY": "loadtest",
+        "GEOCODE_CACHE_PATH": os.path.join(workdir, "geocode.sqlite3"),
+        "SESSION_DB_PATH": os.path.join(workdir, "sessions.sqlite3"),
+        "EVENT_DB_PATH": os.path.join(workdir, "events.sqlite3"),
+        "REMINDER_DB_PATH": os.path.join(workdir, "reminders.sqlite3"),
+        "ROUTE_CACHE_PATH": os.path.join(workdir, "route_cache.sqlite3"),
+        "FORECAST_SNAPSHOT_PATH": os.path.join(workdir, "forecast_snapshot.bin"),
+        "QUOTA_DB_PATH": os.path.join(workdir, "quota.sqlite3"),
+    })
+    # 沒有指定界線資料時用 bench 內的簡化界線，桃園與臺北之間的通勤會查沿途天氣
+    os.environ.setdefault("GAZETTEER_BOUNDARIES", BOUNDARIES_FIXTURE)
+    # 假 Nominatim 不需要遵守每秒一次的限制，要量測限速影響時再自行設定
+    os.environ.setdefault("NOMINATIM_MIN_INTERVAL", "0")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20, help="同時進行的虛擬用戶數")
+    parser.add_argument("--flows", type=int, default=3, help="每位用戶走幾次流程")
+    parser.add_argument("--weather-ratio", type=float, default=0.5, help="天氣查詢流程的比例")
+    parser.add_argument("--latency", default="nominatim=0.05,cwa=0.2,google=0.15,line=0.02",
+                        help="各假上游的回應延遲（秒），例如 cwa=0.2,google=0.3")
+    parser.add_argument("--redelivery", type=float, default=0.0, help="每個事件被 LINE 重送一次的機率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    fakes = FakeUpstreams(parse_latency(args.latency)).start()
+    workdir = tempfile.mkdtemp(prefix="amazingbot-loadtest-")
+    configure_env(fakes.url, workdir)
+
+    from werkzeug.serving import make_server
+    import app as bot
+
+    server = make_server("127.0.0.1", 0, bot.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    stats = Stats()
+    users = [
+        VirtualUser(i, base_url, fakes, stats, random.Random(args.seed * 100003 + i), args.redelivery)
+        for i in range(args.users)
+    ]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        for future in [pool.submit(user.run, args.flows, args.weather_ratio) for user in users]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    server.shutdown()
+    fakes.stop()
+    print(f"{args.users} 位用戶 × {args.flows} 個流程，上游延遲 {args.latency}")
+    print(stats.report(elapsed, fakes.calls))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import sys
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+from bench.fakes import FakeUpstreams
+from bench.loadtest import configure_env
+
+# 以假上游與 bench/fixtures 的簡化界線跑一次沿途天氣，確認 Directions、取樣、鄉鎮判斷與批次天氣查詢串得起來
+# 用法：python -m bench.smoke_route_weather [--origin 桃園高鐵站] [--destination 南港展覽館]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--origin", default="桃園高鐵站")
+    parser.add_argument("--destination", default="南港展覽館")
+    parser.add_argument("--mode", default="driving")
+    args = parser.parse_args(argv)
+
+    fakes = FakeUpstreams().start()
+    configure_env(fakes.url, tempfile.mkdtemp(prefix="amazingbot-smoke-"))
+
+    from CommuteBot import get_commute_info
+    from WeatherBot import get_city_and_district
+    import route_weather
+
+    when = (datetime.now() + timedelta(days=1)).replace(hour=8, minute=0).strftime("%Y-%m-%d %H:%M")
+    commute = get_commute_info(args.origin, args.destination, when, args.mode, "departure")
+    origin_info = get_city_and_district(args.origin)
+    dest_info = get_city_and_district(args.destination)
+    timeline = route_weather.route_timeline(args.origin, args.destination, args.mode, origin_info, dest_info, commute)
+    fakes.stop()
+
+    if not timeline:
+        print(f"沒有沿途天氣：commute={commute} origin={origin_info} destination={dest_info}")
+        return 1
+    print(route_weather.format_timeline(timeline))
+    print(f"上游呼叫次數：{', '.join(f'{k}={v}' for k, v in sorted(fakes.calls.items()))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import zipfile
+import argparse
+import tempfile
+
+from gazetteer import GAZETTEER_PATH, DEFAULT_BOUNDARIES_PATH
+from geocache import normalize_place
+
+# 把內政部「鄉鎮市區界線(TWD97經緯度)」轉成 gazetteer 使用的簡化 GeoJSON（預設寫到 town_boundaries.json）。
+# 輸入可以是官方下載的 zip、解開後的 .shp（需要 pyshp：pip install pyshp），或已轉好的 GeoJSON。
+# 用法：python build_boundaries.py TOWN_MOI_xxxx.zip [--tolerance 0.0005] [--output town_boundaries.json]
+
+SIMPLIFY_TOLERANCE = 0.0005  # 約 50 公尺，鄉鎮判斷綽綽有餘，檔案約為原始資料的數十分之一
+COORDINATE_DIGITS = 5  # 小數點後 5 位約 1 公尺
+
+
+def read_features(path):
+    if path.lower().endswith((".json", ".geojson")):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["features"]
+    if path.lower().endswith(".zip"):
+        with tempfile.TemporaryDirectory() as workdir:
+            with zipfile.ZipFile(path) as archive:
+                archive.extractall(workdir)
+            shapes = [os.path.join(root, name) for root, _, names in os.walk(workdir)
+                      for name in names if name.lower().endswith(".shp")]
+            if len(shapes) != 1:
+                raise SystemExit(f"{path} 內應該只有一個 .shp 檔，找到 {len(shapes)} 個")
+            return read_shapefile(shapes[0])
+    return read_shapefile(path)
+
+
+def read_shapefile(path):
+    import shapefile
+    with shapefile.Reader(path, encoding="utf-8") as reader:
+        return [
+            {"properties": record.as_dict(), "geometry": shape.__geo_interface__}
+            for shape, record in zip(reader.iterShapes(), reader.iterRecords())
+        ]
+
+
+# Douglas-Peucker 簡化，保留首尾點；點數不足以構成多邊形時回傳 None
+def simplify(ring, tolerance):
+    points = [tuple(point[:2]) for point in ring]
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, distance = None, tolerance
+        for i in range(first + 1, last):
+            d = _distance(points[i], points[first], points[last])
+            if d > distance:
+                farthest, distance = i, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    simplified = [
+        [round(x, COORDINATE_DIGITS), round(y, COORDINATE_DIGITS)]
+        for (x, y), kept in zip(points, keep) if kept
+    ]
+    return simplified if len(simplified) >= 4 else None
+
+
+def _distance(point, start, end):
+    (x, y), (x1, y1), (x2, y2) = point, start, end
+    dx, dy = x2 - x1, y2 - y1
+    if dx == 0 and dy == 0:
+        return ((x - x1) ** 2 + (y - y1) ** 2) ** 0.5
+    return abs(dy * x - dx * y + x2 * y1 - y2 * x1) / (dx * dx + dy * dy) ** 0.5
+
+
+def build(features, townships, tolerance=SIMPLIFY_TOLERANCE):
+    output = []
+    for feature in features:
+        properties = feature.get("properties") or {}
+        county = normalize_place(properties.get("COUNTYNAME", ""))
+        town = normalize_place(properties.get("TOWNNAME", ""))
+        if town not in townships.get(county, ()):
+            print(f"略過不在鄉鎮清單內的 {county}{town}", file=sys.stderr)
+            continue
+        geometry = feature.get("geometry") or {}
+        polygons = geometry.get("coordinates", [])
+        if geometry.get("type") == "Polygon":
+            polygons = [polygons]
+        simplified = []
+        for rings in polygons:
+            outer = simplify(rings[0], tolerance)
+            if outer is None:
+                continue  # 比簡化門檻還小的離島
+            holes = [hole for hole in (simplify(ring, tolerance) for ring in rings[1:]) if hole]
+            simplified.append([outer] + holes)
+        if simplified:
+            output.append({
+                "type": "Feature",
+                "properties": {"COUNTYNAME": county, "TOWNNAME": town},
+                "geometry": {"type": "MultiPolygon", "coordinates": simplified},
+            })
+    return {"type": "FeatureCollection", "features": output}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="內政部鄉鎮市區界線 zip / .shp，或 GeoJSON")
+    parser.add_argument("--output", default=DEFAULT_BOUNDARIES_PATH)
+    parser.add_argument("--tolerance", type=float, default=SIMPLIFY_TOLERANCE, help="簡化門檻（經緯度）")
+    args = parser.parse_args(argv)
+
+    with open(GAZETTEER_PATH, encoding="utf-8") as f:
+        townships = {county: set(towns) for county, towns in json.load(f).items()}
+    collection = build(read_features(args.source), townships, args.tolerance)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(collection, f, ensure_ascii=False, separators=(",", ":"))
+
+    found = {(f["properties"]["COUNTYNAME"], f["properties"]["TOWNNAME"]) for f in collection["features"]}
+    missing = sum(len(towns) for towns in townships.values()) - len(found)
+    print(f"寫入 {args.output}：{len(found)} 個鄉鎮，{os.path.getsize(args.output) / 1024:.0f} KB；缺少 {missing} 個")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
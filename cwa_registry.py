@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+# CWA 鄉鎮天氣預報資料集登錄表：縣市 -> (未來 3 天, 未來 1 週) 資料集代碼
+CWA_DATASETS = {
+    "宜蘭縣": ("F-D0047-001", "F-D0047-003"),
+    "桃園市": ("F-D0047-005", "F-D0047-007"),
+    "新竹縣": ("F-D0047-009", "F-D0047-011"),
+    "苗栗縣": ("F-D0047-013", "F-D0047-015"),
+    "彰化縣": ("F-D0047-017", "F-D0047-019"),
+    "南投縣": ("F-D0047-021", "F-D0047-023"),
+    "雲林縣": ("F-D0047-025", "F-D0047-027"),
+    "嘉義縣": ("F-D0047-029", "F-D0047-031"),
+    "屏東縣": ("F-D0047-033", "F-D0047-035"),
+    "臺東縣": ("F-D0047-037", "F-D0047-039"),
+    "花蓮縣": ("F-D0047-041", "F-D0047-043"),
+    "澎湖縣": ("F-D0047-045", "F-D0047-047"),
+    "基隆市": ("F-D0047-049", "F-D0047-051"),
+    "新竹市": ("F-D0047-053", "F-D0047-055"),
+    "嘉義市": ("F-D0047-057", "F-D0047-059"),
+    "臺北市": ("F-D0047-061", "F-D0047-063"),
+    "高雄市": ("F-D0047-065", "F-D0047-067"),
+    "新北市": ("F-D0047-069", "F-D0047-071"),
+    "臺中市": ("F-D0047-073", "F-D0047-075"),
+    "臺南市": ("F-D0047-077", "F-D0047-079"),
+    "連江縣": ("F-D0047-081", "F-D0047-083"),
+    "金門縣": ("F-D0047-085", "F-D0047-087"),
+}
+
+THREE_DAY = "3day"
+WEEKLY = "weekly"
+
+# 各產品 get_weather 實際會用到的天氣因子，只向 CWA 要這些欄位
+PRODUCT_ELEMENTS = {
+    THREE_DAY: ("天氣現象", "溫度", "體感溫度", "3小時降雨機率"),
+    WEEKLY: ("天氣現象", "最高溫度", "最低溫度", "最高體感溫度", "最低體感溫度", "12小時降雨機率", "紫外線指數"),
+}
+
+# 3 天預報涵蓋的時間範圍，超過就改用一週預報
+THREE_DAY_HORIZON = timedelta(hours=66)
+# 向前多保留的時段，避免剛開始的預報時段被 timeFrom 切掉
+LOOKBACK = timedelta(hours=12)
+
+
+class UnknownCityError(ValueError):
+    pass
+
+
+# 依查詢時間距離現在多久挑選產品
+def select_product(target_time, now=None):
+    now = now or datetime.now()
+    return THREE_DAY if target_time - now <= THREE_DAY_HORIZON else WEEKLY
+
+
+def dataset_id(city, product):
+    datasets = CWA_DATASETS.get((city or "").replace("台", "臺"))
+    if datasets is None:
+        raise UnknownCityError(city)
+    return datasets[0] if product == THREE_DAY else datasets[1]
+
+
+DATASET_PRODUCTS = {}
+for _three_day, _weekly in CWA_DATASETS.values():
+    DATASET_PRODUCTS[_three_day] = THREE_DAY
+    DATASET_PRODUCTS[_weekly] = WEEKLY
+
+
+def product_of(dataset):
+    return DATASET_PRODUCTS[dataset]
+
+
+# 組出只含必要天氣因子與時間範圍的查詢參數
+def build_params(dataset, api_key, location_name=None, time_from=None, time_to=None):
+    product = product_of(dataset)
+    params = {
+        "Authorization": api_key,
+        "ElementName": ",".join(PRODUCT_ELEMENTS[product]),
+    }
+    if location_name:
+        params["LocationName"] = location_name
+    if time_from:
+        params["timeFrom"] = time_from.strftime("%Y-%m-%dT%H:%M:%S")
+    if time_to:
+        params["timeTo"] = time_to.strftime("%Y-%m-%dT%H:%M:%S")
+    return params
+
+
+# 縣市層級快取用的查詢參數：整個縣市、從現在（往前留一點）到產品涵蓋的最後時間
+def county_params(dataset, api_key, now=None):
+    now = (now or datetime.now()).replace(minute=0, second=0, microsecond=0)
+    return build_params(dataset, api_key, time_from=now - LOOKBACK)
@@ -0,0 +1,57 @@
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MULTICAST_CHUNK = int(os.getenv('MULTICAST_CHUNK', 500))  # LINE multicast 每次最多 500 人
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', 8))
+
+_executor = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix="delivery")
+
+
+# 批次發送：相同輸入的通知只組一次訊息，再以 multicast 分批送給所有收件人
+class DeliveryBatch:
+    def __init__(self, multicast, chunk_size=MULTICAST_CHUNK):
+        self.multicast = multicast  # multicast(user_ids, text)
+        self.chunk_size = chunk_size
+        self._groups = {}  # key -> (compose, {user_id: None})，dict 保留加入順序並去除重複
+        self.failed = []  # 上一次 flush 時訊息組不出來或 multicast 失敗的用戶，由呼叫端決定是否重試
+
+    # key 需涵蓋所有會影響訊息內容的輸入，compose() 回傳訊息文字
+    def add(self, user_id, key, compose):
+        self._groups.setdefault(key, (compose, {}))[1][user_id] = None
+
+    def __len__(self):
+        return sum(len(users) for _, users in self._groups.values())
+
+    # 各組訊息平行組好後分批送出，回傳 (組數, multicast 次數)
+    def flush(self):
+        groups, self._groups = list(self._groups.values()), {}
+        self.failed = []
+        texts = _executor.map(_safe_compose, [compose for compose, _ in groups])
+        calls = 0
+        for (_, users), text in zip(groups, texts):
+            users = list(users)
+            if text is None:
+                self.failed.extend(users)
+                continue
+            for i in range(0, len(users), self.chunk_size):
+                chunk = users[i:i + self.chunk_size]
+                try:
+                    self.multicast(chunk, text)
+                    calls += 1
+                except Exception:
+                    logger.exception(f"multicast 給 {len(chunk)} 位用戶失敗")
+                    self.failed.extend(chunk)
+        if groups:
+            logger.info(f"批次發送 {len(groups)} 種訊息，共 {calls} 次 multicast")
+        return len(groups), calls
+
+
+def _safe_compose(compose):
+    try:
+        return compose()
+    except Exception:
+        logger.exception("組出通知訊息失敗")
+        return None
@@ -0,0 +1,51 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+SWEEP_STEP_MINUTES = int(os.getenv('SWEEP_STEP_MINUTES', 15))  # 候選出發時間的間隔
+SWEEP_COARSE_POINTS = int(os.getenv('SWEEP_COARSE_POINTS', 5))  # 第一輪平均取樣的點數
+SWEEP_MAX_CALLS = int(os.getenv('SWEEP_MAX_CALLS', 10))  # 每次掃描最多查詢幾個出發時間
+SWEEP_PROBES = int(os.getenv('SWEEP_PROBES', 5))  # 同時查詢的數量
+
+_executor = ThreadPoolExecutor(max_workers=SWEEP_PROBES, thread_name_prefix="sweep")
+
+
+# 在 start～end 之間的候選出發時間中，找通勤時間 evaluate(d) 最短者。候選時間為用戶指定的 start，
+# 之後接對齊整點的每 step 秒一格（不同用戶的相同時段可以共用路線快取）。
+# 先平均取 coarse_points 個點同時查詢，之後每一輪只在目前最佳點與左右已查詢點之間取中點，
+# 直到最佳點的相鄰格都查過或用完 max_calls 次；全部取樣點的通勤時間都相同時不再細分。
+def sweep(evaluate, start, end, step=SWEEP_STEP_MINUTES * 60, max_calls=SWEEP_MAX_CALLS,
+          coarse_points=SWEEP_COARSE_POINTS):
+    slots = [start] + list(range(start - start % step + step, end + 1, step))
+    if len(slots) <= coarse_points:
+        pending = list(range(len(slots)))
+    else:
+        points = max(coarse_points, 2)
+        pending = sorted({round(i * (len(slots) - 1) / (points - 1)) for i in range(points)})
+    pending = pending[:max_calls]
+    evaluated = {}  # 格子編號 -> (通勤秒數, 原始資料)
+    rounds = 0
+
+    while pending:
+        rounds += 1
+        for index, result in zip(pending, _executor.map(evaluate, [slots[i] for i in pending])):
+            evaluated[index] = result
+        if rounds == 1 and len({duration for duration, _ in evaluated.values()}) == 1:
+            break
+
+        best = min(evaluated, key=lambda i: (evaluated[i][0], i))
+        done = sorted(evaluated)
+        position = done.index(best)
+        neighbors = done[max(position - 1, 0):position] + done[position + 1:position + 2]
+        pending = [(best + neighbor) // 2 for neighbor in neighbors if abs(best - neighbor) > 1]
+        pending = pending[:max_calls - len(evaluated)]
+
+    best = min(evaluated, key=lambda i: (evaluated[i][0], i))
+    duration, detail = evaluated[best]
+    return {
+        "departure": slots[best],
+        "duration": duration,
+        "detail": detail,
+        "curve": [(slots[i], evaluated[i][0]) for i in sorted(evaluated)],
+        "rounds": rounds,
+        "evaluations": len(evaluated),
+    }
@@ -0,0 +1,143 @@
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from session_store import SESSION_BACKEND, REDIS_URL
+
+# 已處理的 webhookEventId，LINE 重送同一事件時直接略過；多 worker 部署請用 sqlite 或 redis
+EVENT_STORE_BACKEND = os.getenv('EVENT_STORE_BACKEND', SESSION_BACKEND)  # memory / sqlite / redis
+EVENT_STORE_TTL = int(os.getenv('EVENT_STORE_TTL', 60 * 60 * 24))  # 處理完的事件保留一天
+EVENT_STORE_LEASE = int(os.getenv('EVENT_STORE_LEASE', 120))  # 處理中的事件超過幾秒沒完成，視為 worker 已中斷
+EVENT_STORE_MAX = int(os.getenv('EVENT_STORE_MAX', 100000))
+EVENT_DB_PATH = os.getenv('EVENT_DB_PATH', 'events.sqlite3')
+
+PROCESSING = "processing"
+DONE = "done"
+
+
+# 事件處理紀錄介面：claim() 成功的 worker 才處理事件，完成後 finish()，失敗時 release() 讓重送可以再處理
+class EventStore:
+    # 回傳 True 表示由呼叫端處理；事件已處理完或其他 worker 正在處理時回傳 False
+    def claim(self, event_id):
+        raise NotImplementedError
+
+    def finish(self, event_id):
+        raise NotImplementedError
+
+    def release(self, event_id):
+        raise NotImplementedError
+
+
+# 行程內的後端：到期或超過上限時淘汰最舊的紀錄
+class MemoryEventStore(EventStore):
+    def __init__(self, ttl=EVENT_STORE_TTL, lease=EVENT_STORE_LEASE, maxsize=EVENT_STORE_MAX):
+        self.ttl = ttl
+        self.lease = lease
+        self.maxsize = maxsize
+        self._items = OrderedDict()  # event_id -> (狀態, expires_at)
+        self._lock = threading.Lock()
+
+    def claim(self, event_id):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(event_id)
+            if item is not None and item[1] > now:
+                return False
+            self._store(event_id, PROCESSING, now + self.lease)
+            return True
+
+    def finish(self, event_id):
+        with self._lock:
+            self._store(event_id, DONE, time.time() + self.ttl)
+
+    def release(self, event_id):
+        with self._lock:
+            self._items.pop(event_id, None)
+
+    def _store(self, event_id, state, expires_at):
+        self._items[event_id] = (state, expires_at)
+        self._items.move_to_end(event_id)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+
+# SQLite（WAL 模式）後端，同一台主機上的多個 gunicorn worker 可共用
+class SQLiteEventStore(EventStore):
+    def __init__(self, path=EVENT_DB_PATH, ttl=EVENT_STORE_TTL, lease=EVENT_STORE_LEASE):
+        self.path = path
+        self.ttl = ttl
+        self.lease = lease
+        self._local = threading.local()
+        self._writes = 0
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            "event_id TEXT PRIMARY KEY, state TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    # 沒有紀錄或紀錄已過期才寫入，單一敘述完成，多個 worker 同時 claim 只有一個成功
+    def claim(self, event_id):
+        now = time.time()
+        cursor = self._db().execute(
+            "INSERT INTO events (event_id, state, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (event_id) DO UPDATE SET state = excluded.state, expires_at = excluded.expires_at "
+            "WHERE events.expires_at <= ?",
+            (event_id, PROCESSING, now + self.lease, now)
+        )
+        self._purge(now)
+        return cursor.rowcount > 0
+
+    def finish(self, event_id):
+        self._db().execute(
+            "UPDATE events SET state = ?, expires_at = ? WHERE event_id = ?",
+            (DONE, time.time() + self.ttl, event_id)
+        )
+
+    def release(self, event_id):
+        self._db().execute("DELETE FROM events WHERE event_id = ?", (event_id,))
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA busy_timeout = 10000")
+            self._local.db = db
+        return db
+
+    # 偶爾順便清掉過期的紀錄
+    def _purge(self, now):
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._db().execute("DELETE FROM events WHERE expires_at <= ?", (now,))
+
+
+# Redis 協定後端，可跨多台主機共用；過期交給 Redis 的 TTL 處理
+class RedisEventStore(EventStore):
+    def __init__(self, client=None, ttl=EVENT_STORE_TTL, lease=EVENT_STORE_LEASE, prefix="event:"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(REDIS_URL)
+        self.client = client
+        self.ttl = ttl
+        self.lease = lease
+        self.prefix = prefix
+
+    def claim(self, event_id):
+        return bool(self.client.set(self.prefix + event_id, PROCESSING, nx=True, ex=self.lease))
+
+    def finish(self, event_id):
+        self.client.set(self.prefix + event_id, DONE, ex=self.ttl)
+
+    def release(self, event_id):
+        self.client.delete(self.prefix + event_id)
+
+
+def create_event_store(backend=EVENT_STORE_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteEventStore()
+    if backend == 'redis':
+        return RedisEventStore()
+    return MemoryEventStore()
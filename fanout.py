@@ -0,0 +1,94 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+FANOUT_WORKERS = int(os.getenv('FANOUT_WORKERS', 16))
+
+_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+
+# 相依工作圖：沒有相依的工作同時開始，相依的工作在其輸入完成後立即執行。
+# run() 在期限內回傳已完成的結果，逾時或失敗的工作不會出現在結果中。
+# optional 的工作（例如回覆中附加的資訊）不拖延回覆：必要的工作完成後最多再等 optional_timeout 秒。
+class TaskGraph:
+    def __init__(self, executor=None):
+        self._executor = executor or _executor
+        self._tasks = {}  # 名稱 -> (函式, 相依工作名稱)
+        self._optional = set()
+        self._results = {}
+        self._failed = set()
+        self._started = set()
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._required_finished = threading.Event()
+
+    # fn 會以相依工作的結果作為位置參數依序傳入
+    def add(self, name, fn, *deps, optional=False):
+        self._tasks[name] = (fn, deps)
+        if optional:
+            self._optional.add(name)
+        return self
+
+    def run(self, timeout=None, optional_timeout=0):
+        if not self._tasks:
+            return {}
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._schedule()
+        if not self._required_finished.wait(timeout):
+            logger.warning(f"平行查詢逾時，未完成：{self._pending(required=True)}")
+        else:
+            remaining = optional_timeout if deadline is None else min(optional_timeout, deadline - time.monotonic())
+            if not self._finished.wait(max(remaining, 0)):
+                logger.info(f"不等待未完成的選用查詢：{self._pending(required=False)}")
+        with self._lock:
+            return dict(self._results)
+
+    def _pending(self, required):
+        with self._lock:
+            return [
+                name for name in self._tasks
+                if name not in self._results and name not in self._failed and (name in self._optional) != required
+            ]
+
+    def _schedule(self):
+        ready = []
+        with self._lock:
+            changed = True
+            while changed:
+                changed = False
+                for name, (fn, deps) in self._tasks.items():
+                    if name in self._started:
+                        continue
+                    if any(dep in self._failed for dep in deps):
+                        # 相依工作失敗，這個工作也無法執行
+                        self._started.add(name)
+                        self._failed.add(name)
+                        changed = True
+                    elif all(dep in self._results for dep in deps):
+                        self._started.add(name)
+                        ready.append((name, fn, [self._results[dep] for dep in deps]))
+            finished = self._results.keys() | self._failed
+            required_done = all(name in finished or name in self._optional for name in self._tasks)
+            done = len(finished) == len(self._tasks)
+        if required_done:
+            self._required_finished.set()
+        if done:
+            self._finished.set()
+        for name, fn, args in ready:
+            self._executor.submit(self._run_task, name, fn, args)
+
+    def _run_task(self, name, fn, args):
+        try:
+            result = fn(*args)
+        except Exception:
+            logger.exception(f"平行查詢 {name} 失敗")
+            with self._lock:
+                self._failed.add(name)
+        else:
+            with self._lock:
+                self._results[name] = result
+        self._schedule()
@@ -0,0 +1,137 @@
+import sys
+from array import array
+from bisect import bisect_right
+from datetime import datetime
+
+_EPOCH = datetime(1970, 1, 1)
+MISSING = -2 ** 31  # 整數欄位中代表「沒有這個值」
+INT_COLUMN = "i"  # 數值直接存成 int32
+STR_COLUMN = "s"  # 存字串表的編號
+
+
+# 時間一律換成不帶時區的秒數（CWA 皆為 +08:00），不受伺服器時區影響
+def _seconds(value):
+    return int((value - _EPOCH).total_seconds())
+
+
+def _parse_time(value):
+    return _seconds(datetime.fromisoformat(value.replace("+08:00", "")))
+
+
+def _is_int(value):
+    return isinstance(value, str) and value.lstrip("-").isdigit() and str(int(value)) == value
+
+
+# 同一份索引內的字串只存一份（天氣描述、紫外線等級等大量重複的值），並以 sys.intern 跨縣市共用
+class StringTable:
+    __slots__ = ("strings", "_ids")
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self._ids = {s: i for i, s in enumerate(self.strings)}
+
+    def id(self, value):
+        i = self._ids.get(value)
+        if i is None:
+            i = self._ids[value] = len(self.strings)
+            self.strings.append(sys.intern(value))
+        return i
+
+
+# 單一鄉鎮、單一天氣因子的時間序列：起訖時間與各欄位值皆以陣列欄位保存，可用 bisect 查詢。
+# 陣列也可以是 mmap 快照上的 memoryview，不必複製。
+class ElementSeries:
+    __slots__ = ("starts", "ends", "fields", "strings")
+
+    def __init__(self, starts, ends, fields, strings):
+        self.starts = starts
+        self.ends = ends
+        self.fields = fields  # ((欄位名稱, INT_COLUMN / STR_COLUMN, 欄位陣列), ...)
+        self.strings = strings  # 字串表（list）
+
+    @classmethod
+    def parse(cls, entries, table):
+        rows = sorted((
+            (_parse_time(entry.get("StartTime") or entry["DataTime"]),
+             _parse_time(entry["EndTime"]) if entry.get("EndTime") else None,
+             entry["ElementValue"][0])
+            for entry in entries
+            if entry.get("ElementValue")
+        ), key=lambda row: row[0])
+        starts = array("q", (row[0] for row in rows))
+        ends = array("q")
+        # 3 天預報的溫度類因子只有 DataTime，視為有效到下一筆為止
+        for i, row in enumerate(rows):
+            if row[1] is not None:
+                ends.append(row[1])
+            elif i + 1 < len(rows):
+                ends.append(starts[i + 1])
+            else:
+                ends.append(starts[i] + (starts[i] - starts[i - 1] if i else 3600))
+
+        names = []
+        for row in rows:
+            for name in row[2]:
+                if name not in names:
+                    names.append(name)
+        fields = []
+        for name in names:
+            values = [row[2].get(name) for row in rows]
+            if all(value is None or _is_int(value) for value in values):
+                column = array("i", (MISSING if value is None else int(value) for value in values))
+                fields.append((sys.intern(name), INT_COLUMN, column))
+            else:
+                column = array("i", (MISSING if value is None else table.id(value) for value in values))
+                fields.append((sys.intern(name), STR_COLUMN, column))
+        return cls(starts, ends, tuple(fields), table.strings)
+
+    # 回傳包含 target_time 的時段資料（與 CWA ElementValue 相同的 dict），沒有則回傳 None
+    def at(self, target_time):
+        t = _seconds(target_time)
+        i = bisect_right(self.starts, t) - 1
+        if i < 0 or t >= self.ends[i]:
+            return None
+        value = {}
+        for name, kind, column in self.fields:
+            item = column[i]
+            if item == MISSING:
+                continue
+            value[name] = str(item) if kind == INT_COLUMN else self.strings[item]
+        return value
+
+    def __len__(self):
+        return len(self.starts)
+
+
+# 將 CWA F-D0047 回應整理成 鄉鎮 -> 天氣因子 -> 時間序列 的索引
+class ForecastIndex:
+    __slots__ = ("_districts", "strings")
+
+    def __init__(self, data=None, districts=None, strings=None):
+        if data is None:
+            self._districts = districts
+            self.strings = strings
+            return
+        table = StringTable()
+        self._districts = {}
+        for location in data["records"]["Locations"]:
+            for loc in location["Location"]:
+                elements = self._districts.setdefault(loc["LocationName"], {})
+                for element in loc["WeatherElement"]:
+                    elements[element["ElementName"]] = ElementSeries.parse(element.get("Time") or [], table)
+        self.strings = table.strings
+
+    def __contains__(self, district):
+        return district in self._districts
+
+    def districts(self):
+        return list(self._districts)
+
+    def elements(self, district):
+        return self._districts.get(district, {})
+
+    def value_at(self, district, element_name, target_time):
+        series = self._districts.get(district, {}).get(element_name)
+        if series is None:
+            return None
+        return series.at(target_time)
@@ -0,0 +1,88 @@
+import os
+import sys
+import json
+import mmap
+from array import array
+
+from forecast_index import ElementSeries, ForecastIndex
+
+# 預報快照：所有縣市的 ForecastIndex 寫成單一檔案，各 worker 以 mmap 讀取，陣列直接指向檔案內容不必複製。
+# 檔案格式：MAGIC、8 bytes 標頭長度、JSON 標頭（字串表與各陣列的位置）、對齊 8 bytes 的陣列資料
+FORECAST_SNAPSHOT_PATH = os.getenv('FORECAST_SNAPSHOT_PATH', 'forecast_snapshot.bin')
+MAGIC = b"AMZFCST1"
+_TIME_FORMAT = "q"
+_COLUMN_FORMAT = "i"
+
+
+def _align(offset):
+    return offset + (-offset % 8)
+
+
+# datasets: dataset_id -> (ForecastIndex, fetched_at)；先寫暫存檔再換名，讀取中的 worker 不受影響
+def dump(datasets, path):
+    blob = bytearray()
+
+    def put(column):
+        blob.extend(b"\0" * (_align(len(blob)) - len(blob)))
+        offset = len(blob)
+        blob.extend(column.tobytes())
+        return offset
+
+    header = {"byteorder": sys.byteorder, "datasets": {}}
+    for dataset_id, (index, fetched_at) in datasets.items():
+        districts = {}
+        for district in index.districts():
+            elements = districts[district] = {}
+            for name, series in index.elements(district).items():
+                elements[name] = [
+                    len(series), put(series.starts), put(series.ends),
+                    [[field, kind, put(column)] for field, kind, column in series.fields],
+                ]
+        header["datasets"][dataset_id] = {
+            "fetched_at": fetched_at, "strings": list(index.strings), "districts": districts,
+        }
+
+    data = json.dumps(header, ensure_ascii=False).encode()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(data).to_bytes(8, "little"))
+        f.write(data)
+        f.write(b"\0" * (_align(16 + len(data)) - 16 - len(data)))
+        f.write(blob)
+    os.replace(tmp, path)
+
+
+# 回傳 dataset_id -> (ForecastIndex, fetched_at)；格式不符時拋出 ValueError
+def load(path):
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:8] != MAGIC:
+        raise ValueError(f"{path} 不是預報快照")
+    length = int.from_bytes(mm[8:16], "little")
+    header = json.loads(mm[16:16 + length])
+    if header["byteorder"] != sys.byteorder:
+        raise ValueError(f"{path} 的位元組順序與本機不同")
+    view = memoryview(mm)
+    base = _align(16 + length)
+
+    def column(offset, count, fmt):
+        start = base + offset
+        return view[start:start + count * array(fmt).itemsize].cast(fmt)
+
+    datasets = {}
+    for dataset_id, item in header["datasets"].items():
+        strings = [sys.intern(s) for s in item["strings"]]
+        districts = {}
+        for district, elements in item["districts"].items():
+            districts[district] = {
+                name: ElementSeries(
+                    column(starts, count, _TIME_FORMAT),
+                    column(ends, count, _TIME_FORMAT),
+                    tuple((field, kind, column(offset, count, _COLUMN_FORMAT)) for field, kind, offset in fields),
+                    strings,
+                )
+                for name, (count, starts, ends, fields) in elements.items()
+            }
+        datasets[dataset_id] = (ForecastIndex(districts=districts, strings=strings), item["fetched_at"])
+    return datasets
@@ -0,0 +1,186 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import quota
+import metrics
+import forecast_snapshot
+
+logger = logging.getLogger(__name__)
+
+# CWA 鄉鎮預報約每 6 小時發布一次，於發布後重新抓取
+FORECAST_TTL = int(os.getenv('FORECAST_TTL', 60 * 60 * 6))
+FORECAST_REFRESH_HOURS = os.getenv('FORECAST_REFRESH_HOURS', '5,11,17,23')
+FORECAST_REFRESH_MINUTE = os.getenv('FORECAST_REFRESH_MINUTE', '40')
+# 過期後最多再沿用多久：期間先回傳舊資料並在背景更新，CWA 故障時查詢也不會卡住
+FORECAST_MAX_STALE = int(os.getenv('FORECAST_MAX_STALE', 60 * 60 * 24))
+
+
+# 以縣市資料集為單位的預報快取，同一縣市所有鄉鎮共用一份資料。
+# 設定 snapshot_path 時（資料須為 ForecastIndex），抓到的資料集會寫進共用的快照檔，
+# 其他 worker 啟動或快取未命中時直接 mmap 讀取，不必再向 CWA 下載。
+# 設定 flight（SingleFlight）時，多個 worker 同時缺同一資料集只有一個會下載，其他等它寫入快照後讀取。
+class ForecastStore:
+    def __init__(self, fetch, ttl=FORECAST_TTL, snapshot_path=None, max_stale=FORECAST_MAX_STALE, flight=None):
+        self.fetch = fetch  # fetch(dataset_id) -> 解析後的 CWA 回應
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.snapshot_path = snapshot_path
+        self.flight = flight
+        self._datasets = {}  # dataset_id -> (data, fetched_at)
+        self._locks = {}
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_mtime = None
+        self._scheduler = None
+        self._revalidating = set()
+        self._refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix="forecast-refresh")
+
+    def get(self, dataset_id):
+        item = self._datasets.get(dataset_id)
+        if self._fresh(item):
+            metrics.cache_result("forecast", True)
+            return item[0]
+        if self._usable(item):
+            metrics.cache_result("forecast", True, stale=True)
+            self._revalidate(dataset_id)
+            return item[0]
+
+        # 同一資料集同時只抓一次，其他請求等待結果
+        with self._dataset_lock(dataset_id):
+            item = self._datasets.get(dataset_id)
+            if not self._fresh(item):
+                # 其他 worker 可能已經抓過並寫進快照
+                self.load_snapshot()
+                item = self._datasets.get(dataset_id)
+            if self._fresh(item):
+                metrics.cache_result("forecast", True)
+                return item[0]
+            if self._usable(item):
+                metrics.cache_result("forecast", True, stale=True)
+                self._revalidate(dataset_id)
+                return item[0]
+            metrics.cache_result("forecast", False)
+            return self._coalesced_load(dataset_id)
+
+    def refresh(self, dataset_id, save=True):
+        with self._dataset_lock(dataset_id):
+            return self._load(dataset_id, save)
+
+    # 背景更新過期的資料集，同一資料集同時只排一次；失敗時繼續沿用舊資料
+    def _revalidate(self, dataset_id):
+        with self._lock:
+            if dataset_id in self._revalidating:
+                return
+            self._revalidating.add(dataset_id)
+        self._refresher.submit(self._background_refresh, dataset_id)
+
+    def _background_refresh(self, dataset_id):
+        try:
+            with quota.priority(quota.PREWARM), self._dataset_lock(dataset_id):
+                self.load_snapshot()
+                if not self._fresh(self._datasets.get(dataset_id)):
+                    self._coalesced_load(dataset_id)
+        except Exception as e:
+            logger.warning(f"背景更新預報資料集 {dataset_id} 失敗，繼續使用舊資料：{e}")
+        finally:
+            with self._lock:
+                self._revalidating.discard(dataset_id)
+
+    # 全部更新完才寫一次快照
+    def refresh_all(self):
+        for dataset_id in list(self._datasets):
+            try:
+                with quota.priority(quota.PREWARM):
+                    self.refresh(dataset_id, save=False)
+            except Exception:
+                logger.exception(f"更新預報資料集 {dataset_id} 失敗")
+        self.save_snapshot()
+
+    # 讀入快照中比手上新的資料集；檔案沒變動時不重新讀取
+    def load_snapshot(self):
+        if not self.snapshot_path:
+            return 0
+        with self._snapshot_lock:
+            try:
+                mtime = os.stat(self.snapshot_path).st_mtime_ns
+                if mtime == self._snapshot_mtime:
+                    return 0
+                datasets = forecast_snapshot.load(self.snapshot_path)
+            except FileNotFoundError:
+                return 0
+            except (OSError, ValueError):
+                logger.exception(f"讀取預報快照 {self.snapshot_path} 失敗")
+                return 0
+            self._snapshot_mtime = mtime
+            loaded = 0
+            for dataset_id, item in datasets.items():
+                current = self._datasets.get(dataset_id)
+                if self._usable(item) and (current is None or current[1] < item[1]):
+                    self._datasets[dataset_id] = item
+                    loaded += 1
+            if loaded:
+                logger.info(f"已從快照載入 {loaded} 個預報資料集")
+            return loaded
+
+    # 先合併其他 worker 寫入的資料集，再把所有未過期的資料集寫回快照
+    def save_snapshot(self):
+        if not self.snapshot_path:
+            return
+        self.load_snapshot()
+        with self._snapshot_lock:
+            usable = {k: v for k, v in self._datasets.items() if self._usable(v)}
+            try:
+                forecast_snapshot.dump(usable, self.snapshot_path)
+                self._snapshot_mtime = os.stat(self.snapshot_path).st_mtime_ns
+            except OSError:
+                logger.exception(f"寫入預報快照 {self.snapshot_path} 失敗")
+
+    def start(self, scheduler=None):
+        if self._scheduler is not None:
+            return self._scheduler
+        self.load_snapshot()
+        if scheduler is None:
+            scheduler = BackgroundScheduler(daemon=True)
+        scheduler.add_job(
+            self.refresh_all, 'cron',
+            hour=FORECAST_REFRESH_HOURS, minute=FORECAST_REFRESH_MINUTE,
+            id='forecast_refresh', replace_existing=True, coalesce=True
+        )
+        if not scheduler.running:
+            scheduler.start()
+        self._scheduler = scheduler
+        return scheduler
+
+    def _load(self, dataset_id, save=True):
+        data = self.fetch(dataset_id)
+        self._datasets[dataset_id] = (data, time.time())
+        logger.info(f"已更新預報資料集 {dataset_id}")
+        if save:
+            self.save_snapshot()
+        return data
+
+    # 呼叫端需持有該資料集的鎖；其他 worker 下載完成時改讀快照
+    def _coalesced_load(self, dataset_id):
+        if self.flight is None:
+            return self._load(dataset_id)
+        return self.flight.do(dataset_id, lambda: self._load(dataset_id), recheck=lambda: self._snapshot_item(dataset_id))
+
+    def _snapshot_item(self, dataset_id):
+        self.load_snapshot()
+        item = self._datasets.get(dataset_id)
+        return item[0] if self._fresh(item) else None
+
+    def _fresh(self, item):
+        return item is not None and time.time() - item[1] < self.ttl
+
+    def _usable(self, item):
+        return item is not None and time.time() - item[1] < self.ttl + self.max_stale
+
+    def _dataset_lock(self, dataset_id):
+        with self._lock:
+            return self._locks.setdefault(dataset_id, threading.Lock())
@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import logging
+
+from geocache import normalize_place
+
+logger = logging.getLogger(__name__)
+
+# 全臺 22 縣市、368 鄉鎮市區的 CWA 標準名稱（依中華郵政郵遞區號資料整理）
+GAZETTEER_PATH = os.getenv('GAZETTEER_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'townships.json'))
+# 內政部鄉鎮市區界線簡化後的 GeoJSON（屬性含 COUNTYNAME、TOWNNAME），由 build_boundaries.py 產生；
+# 檔案存在才提供座標查詢，設為空字串則不載入
+DEFAULT_BOUNDARIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'town_boundaries.json')
+GAZETTEER_BOUNDARIES = os.getenv('GAZETTEER_BOUNDARIES', DEFAULT_BOUNDARIES_PATH)
+GAZETTEER_GRID = float(os.getenv('GAZETTEER_GRID', 0.05))  # 空間索引格子大小（經緯度）
+
+_COORDINATES = re.compile(r"^\s*(-?\d{1,3}(?:\.\d+)?)\s*[,，]\s*(-?\d{1,3}(?:\.\d+)?)\s*$")
+
+
+def _pattern(names):
+    # 長的名稱優先，避免「東區」比「中西區」先被比對到
+    return re.compile("|".join(re.escape(name) for name in sorted(names, key=len, reverse=True)))
+
+
+# 離線的鄉鎮查詢：地名中含有縣市與鄉鎮名稱、或輸入經緯度時直接解析，不必呼叫 Nominatim
+class Gazetteer:
+    def __init__(self, townships, boundaries=None, cell=GAZETTEER_GRID):
+        self.townships = {county: set(towns) for county, towns in townships.items()}
+        self._town_counties = {}
+        for county, towns in townships.items():
+            for town in towns:
+                self._town_counties.setdefault(town, []).append(county)
+        self._county_pattern = _pattern(townships)
+        self._town_pattern = _pattern(self._town_counties)
+        self.cell = cell
+        self._grid = {}  # (格子 x, 格子 y) -> [polygon 編號]
+        self._polygons = []  # (縣市, 鄉鎮, bbox, rings)
+        if boundaries:
+            self.load_boundaries(boundaries)
+
+    @classmethod
+    def load(cls, path=GAZETTEER_PATH, boundaries_path=GAZETTEER_BOUNDARIES):
+        with open(path, encoding="utf-8") as f:
+            townships = json.load(f)
+        boundaries = None
+        if boundaries_path and os.path.exists(boundaries_path):
+            with open(boundaries_path, encoding="utf-8") as f:
+                boundaries = json.load(f)
+        elif boundaries_path:
+            # 部署時必須以 build_boundaries.py 產生（見 README），缺少時服務仍可啟動但功能不完整
+            logger.error(f"找不到鄉鎮界線 {boundaries_path}，經緯度查詢與沿途天氣停用，請以 build_boundaries.py 產生")
+        return cls(townships, boundaries)
+
+    # 由自由文字解析縣市與鄉鎮，無法唯一判斷時回傳 None
+    def resolve(self, place_name):
+        match = _COORDINATES.match(place_name or "")
+        if match:
+            return self.locate(float(match.group(1)), float(match.group(2)))
+
+        text = normalize_place(place_name).replace(" ", "")
+        counties = {m.group() for m in self._county_pattern.finditer(text)}
+        candidates = set()
+        for m in self._town_pattern.finditer(text):
+            for county in self._town_counties[m.group()]:
+                if not counties or county in counties:
+                    candidates.add((county, m.group()))
+        if len(candidates) == 1:
+            return candidates.pop()
+        return None
+
+    # Nominatim 的 address 欄位依地區不同，逐一比對出 CWA 使用的縣市與鄉鎮名稱
+    def match_address(self, address):
+        values = [normalize_place(str(value)) for value in address.values()]
+        for county in values:
+            if county not in self.townships:
+                continue
+            for town in values:
+                if town in self.townships[county]:
+                    return county, town
+        return None
+
+    # 是否載入了鄉鎮界線（沒有時 locate() 一律回傳 None）
+    @property
+    def has_boundaries(self):
+        return bool(self._polygons)
+
+    # 經緯度所在的鄉鎮（需要界線資料）
+    def locate(self, lat, lon):
+        for index in self._grid.get(self._cell_of(lon, lat), ()):
+            county, town, (min_x, min_y, max_x, max_y), rings = self._polygons[index]
+            if min_x <= lon <= max_x and min_y <= lat <= max_y and _contains(rings, lon, lat):
+                return county, town
+        return None
+
+    def load_boundaries(self, geojson):
+        for feature in geojson.get("features", []):
+            properties = feature.get("properties") or {}
+            county = normalize_place(properties.get("COUNTYNAME", ""))
+            town = normalize_place(properties.get("TOWNNAME", ""))
+            if town not in self.townships.get(county, ()):
+                logger.warning(f"界線資料中的 {county}{town} 不在鄉鎮清單內，略過")
+                continue
+            geometry = feature.get("geometry") or {}
+            polygons = geometry.get("coordinates", [])
+            if geometry.get("type") == "Polygon":
+                polygons = [polygons]
+            for rings in polygons:
+                self._add_polygon(county, town, rings)
+
+    def _add_polygon(self, county, town, rings):
+        xs = [point[0] for point in rings[0]]
+        ys = [point[1] for point in rings[0]]
+        bbox = (min(xs), min(ys), max(xs), max(ys))
+        index = len(self._polygons)
+        self._polygons.append((county, town, bbox, rings))
+        min_cx, min_cy = self._cell_of(bbox[0], bbox[1])
+        max_cx, max_cy = self._cell_of(bbox[2], bbox[3])
+        for cx in range(min_cx, max_cx + 1):
+            for cy in range(min_cy, max_cy + 1):
+                self._grid.setdefault((cx, cy), []).append(index)
+
+    def _cell_of(self, x, y):
+        return int(x // self.cell), int(y // self.cell)
+
+
+# 射線法判斷點是否在多邊形內：在外框內且不在任何洞內
+def _contains(rings, x, y):
+    if not _in_ring(rings[0], x, y):
+        return False
+    return not any(_in_ring(hole, x, y) for hole in rings[1:])
+
+
+def _in_ring(ring, x, y):
+    inside = False
+    x1, y1 = ring[-1][0], ring[-1][1]
+    for point in ring:
+        x2, y2 = point[0], point[1]
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+        x1, y1 = x2, y2
+    return inside
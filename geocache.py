@@ -0,0 +1,98 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+GEOCODE_CACHE_PATH = os.getenv('GEOCODE_CACHE_PATH', 'geocode_cache.sqlite3')
+GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', 60 * 60 * 24 * 30))  # 成功結果保留 30 天
+GEOCODE_NEGATIVE_TTL = int(os.getenv('GEOCODE_NEGATIVE_TTL', 60 * 60 * 24))  # 找不到地址保留 1 天
+GEOCODE_STALE_TTL = int(os.getenv('GEOCODE_STALE_TTL', 60 * 60 * 24 * 7))  # 過期後仍可先沿用、同時背景更新的時間
+GEOCODE_LRU_SIZE = int(os.getenv('GEOCODE_LRU_SIZE', 1024))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+# 正規化地名作為快取鍵：全形轉半形、去除多餘空白、台/臺 統一
+def normalize_place(place_name):
+    key = unicodedata.normalize("NFKC", place_name or "")
+    key = _WHITESPACE.sub(" ", key).strip().lower()
+    return key.replace("台", "臺")
+
+
+# 兩層地理編碼快取：行程內 LRU + 磁碟上的 SQLite
+class GeoCache:
+    def __init__(self, path=GEOCODE_CACHE_PATH, maxsize=GEOCODE_LRU_SIZE, stale_ttl=GEOCODE_STALE_TTL):
+        self.maxsize = maxsize
+        self.stale_ttl = stale_ttl
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS geocode ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM geocode WHERE expires_at <= ?", (time.time() - stale_ttl,))
+            self._db.commit()
+
+    def get(self, key):
+        item = self.lookup(key)
+        if item is None or not item[1]:
+            return None
+        return item[0]
+
+    # 回傳 (value, 是否未過期)；過期但還在 stale_ttl 內的資料也會回傳，由呼叫端決定是否背景更新
+    def lookup(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._lru.get(key)
+            if item is not None:
+                value, expires_at = item
+                if expires_at + self.stale_ttl > now:
+                    self._lru.move_to_end(key)
+                    return value, expires_at > now
+                del self._lru[key]
+
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT value, expires_at FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.stale_ttl <= now:
+                self._db.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                self._db.commit()
+                return None
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            return value, row[1] > now
+
+    def set(self, key, value, ttl=GEOCODE_CACHE_TTL):
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO geocode (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM geocode")
+                self._db.commit()
+
+    def _remember(self, key, value, expires_at):
+        self._lru[key] = (value, expires_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.maxsize:
+            self._lru.popitem(last=False)
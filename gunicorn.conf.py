@@ -0,0 +1,33 @@
+import os
+
+from dotenv import load_dotenv
+
+# 載入環境變數（需在匯入會讀取設定的模組之前）
+load_dotenv()
+
+import metrics
+from rich_menu import sync_rich_menu, default_line_api
+
+# gunicorn 啟動設定：gunicorn -c gunicorn.conf.py app:app
+# 多 worker 時請設定 METRICS_DIR，讓 /metrics 加總所有 worker 的數值
+RICH_MENU_SYNC = os.getenv('RICH_MENU_SYNC', '1') == '1'
+
+
+# 服務啟動時清掉上一次留下的指標檔
+def on_starting(server):
+    metrics.reset_dir()
+
+
+# master 準備好後同步一次 Rich Menu；內容沒變時只有兩次查詢，失敗也不影響服務啟動
+def when_ready(server):
+    if not RICH_MENU_SYNC:
+        return
+    try:
+        sync_rich_menu(default_line_api())
+    except Exception:
+        server.log.exception("同步 Rich Menu 失敗")
+
+
+# worker 結束後它的進行中數量歸零，計數器保留
+def child_exit(server, worker):
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# 多 worker 部署時每個行程把自己的數值寫到 METRICS_DIR/<pid>.json，/metrics 讀取全部檔案後加總。
+# 未設定時只回報目前行程的數值。
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', 5))
+PREFIX = "amazingbot_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HELP = {
+    "upstream_request_seconds": ("histogram", "上游 HTTP 請求耗時（每次嘗試各記一筆）"),
+    "upstream_errors_total": ("counter", "上游請求失敗次數，依錯誤種類區分"),
+    "upstream_in_flight": ("gauge", "進行中的上游請求數"),
+    "upstream_circuit_open": ("gauge", "上游斷路器斷開中的 worker 數"),
+    "stage_seconds": ("histogram", "處理階段耗時"),
+    "stage_errors_total": ("counter", "處理階段拋出例外的次數"),
+    "stage_in_flight": ("gauge", "進行中的處理階段數"),
+    "cache_requests_total": ("counter", "快取查詢次數，依命中、過期沿用（stale）與未命中區分"),
+    "cache_hit_ratio": ("gauge", "快取命中率（由 cache_requests_total 計算）"),
+    "quota_spent_total": ("counter", "已扣除的上游額度，依優先順序區分"),
+    "quota_rejected_total": ("counter", "因速率或每日額度被拒絕的上游請求數"),
+    "quota_wait_seconds": ("histogram", "等待上游令牌的時間"),
+    "arrival_solves_total": ("counter", "反推出發時間的次數，依一般與額度不足時的粗略模式區分"),
+    "arrival_solver_rounds_total": ("counter", "反推出發時間的迭代輪數合計（除以 arrival_solves_total 為每次平均）"),
+    "arrival_solver_api_calls_total": ("counter", "反推出發時間實際呼叫 Google 的次數合計（快取命中不計）"),
+    "webhook_events_total": ("counter", "Webhook 事件數，依已處理、重複略過與失敗區分"),
+    "singleflight_requests_total": ("counter", "合併查詢次數，依實際查詢（leader）、行程內合併、跨 worker 共用、逾時區分"),
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> 數值，labels 為排序過的 (key, value) tuple
+_gauges = {}
+_histograms = {}  # (name, labels) -> [各 bucket 次數..., +Inf 次數, 總和]
+_flusher_pid = None
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    _ensure_flusher()
+
+
+def add_gauge(name, amount, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _gauges[key] = _gauges.get(key, 0) + amount
+    _ensure_flusher()
+
+
+def set_gauge(name, value, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        _gauges[key] = value
+    _ensure_flusher()
+
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        values = _histograms.get(key)
+        if values is None:
+            values = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+                break
+        else:
+            values[len(LATENCY_BUCKETS)] += 1
+        values[-1] += seconds
+    _ensure_flusher()
+
+
+# stale 為過期但仍先回傳、並在背景更新的結果，計算命中率時視為命中
+def cache_result(cache, hit, stale=False):
+    inc("cache_requests_total", cache=cache, result="stale" if stale else "hit" if hit else "miss")
+
+
+# 量測一個處理階段：耗時、進行中數量與例外次數
+@contextmanager
+def stage(name):
+    add_gauge("stage_in_flight", 1, stage=name)
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc("stage_errors_total", stage=name)
+        raise
+    finally:
+        observe("stage_seconds", time.perf_counter() - started, stage=name)
+        add_gauge("stage_in_flight", -1, stage=name)
+
+
+# 量測一次上游請求；呼叫端可用 yield 出來的 dict 回報 HTTP 狀態碼
+@contextmanager
+def upstream_request(upstream):
+    add_gauge("upstream_in_flight", 1, upstream=upstream)
+    started = time.perf_counter()
+    result = {"status": None}
+    outcome = "ok"
+    try:
+        yield result
+        status = result["status"]
+        if status is not None and status >= 400:
+            outcome = f"http_{status // 100}xx"
+    except Exception as e:
+        outcome = _error_kind(e)
+        raise
+    finally:
+        observe("upstream_request_seconds", time.perf_counter() - started, upstream=upstream, outcome=outcome)
+        if outcome != "ok":
+            inc("upstream_errors_total", upstream=upstream, kind=outcome)
+        add_gauge("upstream_in_flight", -1, upstream=upstream)
+
+
+def _error_kind(e):
+    name = type(e).__name__
+    if "Timeout" in name:
+        return "timeout"
+    if "Connection" in name:
+        return "connection"
+    return "exception"
+
+
+def snapshot():
+    with _lock:
+        return {
+            "counters": [[n, list(l), v] for (n, l), v in _counters.items()],
+            "gauges": [[n, list(l), v] for (n, l), v in _gauges.items()],
+            "histograms": [[n, list(l), list(v)] for (n, l), v in _histograms.items()],
+        }
+
+
+# 把目前行程的數值寫到 METRICS_DIR，先寫暫存檔再換名，讀取端不會讀到寫一半的檔案
+def flush():
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(snapshot(), f)
+        os.replace(tmp, path)
+    except OSError:
+        logger.exception("寫入指標檔失敗")
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        flush()
+
+
+# fork 之後執行緒不會跟過去，每個行程第一次更新指標時各自啟動寫檔執行緒
+def _ensure_flusher():
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+    atexit.register(flush)
+
+
+# 清空 METRICS_DIR，於整個服務啟動時（gunicorn master）呼叫
+def reset_dir():
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith(".json") or name.endswith(".tmp"):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+
+# worker 結束時移除它的 gauge，計數器與直方圖保留，總數才不會倒退
+def mark_process_dead(pid):
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{pid}.json")
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        data["gauges"] = []
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+    except (OSError, ValueError):
+        pass
+
+
+def _snapshots():
+    own = snapshot()
+    if not METRICS_DIR or not os.path.isdir(METRICS_DIR):
+        return [own]
+    snapshots = [own]
+    own_file = f"{os.getpid()}.json"
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith(".json") or name == own_file:
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+# 合併所有 worker 的數值，輸出 Prometheus 文字格式
+def render():
+    counters, gauges, histograms = {}, {}, {}
+    for data in _snapshots():
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, value in data["gauges"]:
+            key = (name, tuple(map(tuple, labels)))
+            gauges[key] = gauges.get(key, 0) + value
+        for name, labels, values in data["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+
+    # 命中率由加總後的命中與未命中次數計算，各 worker 的比例不能直接相加
+    lookups = {}
+    for (name, labels), value in counters.items():
+        if name == "cache_requests_total":
+            labels = dict(labels)
+            lookups.setdefault(labels["cache"], [0, 0])[0 if labels["result"] != "miss" else 1] += value
+    for cache, (hits, misses) in lookups.items():
+        gauges[("cache_hit_ratio", (("cache", cache),))] = hits / (hits + misses) if hits + misses else 0.0
+
+    lines = []
+    for name in sorted({key[0] for key in (*counters, *gauges, *histograms)}):
+        kind, help_text = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+        for (metric, labels), value in sorted(gauges.items()):
+            if metric == name:
+                lines.append(f"{PREFIX}{name}{_format_labels(labels)} {_format_value(value)}")
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), values[:-1]):
+                cumulative += count
+                lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {_format_value(values[-1])}")
+            lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
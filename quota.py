@@ -0,0 +1,225 @@
+import os
+import time
+import heapq
+import logging
+import sqlite3
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+QUOTA_DB_PATH = os.getenv('QUOTA_DB_PATH', 'quota.sqlite3')
+QUOTA_RESERVE = float(os.getenv('QUOTA_RESERVE', 0.2))  # 每日額度保留給用戶查詢的比例
+QUOTA_MAX_WAIT = float(os.getenv('QUOTA_MAX_WAIT', 5))  # 等待令牌最多幾秒
+NOMINATIM_MIN_INTERVAL = float(os.getenv('NOMINATIM_MIN_INTERVAL', 1.0))  # Nominatim 規定每秒最多 1 次，所有 worker 合計
+
+# 優先順序，數字越小越先取得令牌
+INTERACTIVE = 0  # 用戶正在等待回覆的查詢
+REMINDER = 1  # 發送通勤提醒時更新路況
+PREWARM = 2  # 提醒前預先更新、背景更新過期的快取
+PRIORITY_NAMES = {INTERACTIVE: "interactive", REMINDER: "reminder", PREWARM: "prewarm"}
+# 各優先順序可以用到每日額度的比例：額度快用完時先停背景更新，再停提醒，最後的部分只給用戶查詢
+PRIORITY_SHARE = {INTERACTIVE: 1.0, REMINDER: 1 - QUOTA_RESERVE, PREWARM: 1 - 2 * QUOTA_RESERVE}
+
+_priority = ContextVar("quota_priority", default=INTERACTIVE)
+
+
+# 每秒速率與突發量預設為每個 worker 各自計算，shared 為 True 時改為同一台主機所有 worker 合計；
+# 每日額度（0 為不限）記在 SQLite，所有 worker 與重啟後共用
+def _limits(name, rate, burst, daily_budget, shared=False):
+    prefix = name.upper()
+    return {
+        "rate": float(os.getenv(f'{prefix}_RATE', rate)),
+        "burst": float(os.getenv(f'{prefix}_BURST', burst)),
+        "daily_budget": int(os.getenv(f'{prefix}_DAILY_BUDGET', daily_budget)),
+        "shared": os.getenv(f'{prefix}_SHARED_RATE', str(shared)).lower() in ('1', 'true', 'yes'),
+    }
+
+
+LIMITS = {
+    # Google 依 element 計費；預設不限每日次數，要控制費用時設定 GOOGLE_DAILY_BUDGET
+    # （每月 200 美元的免費額度約為每天 1300 次），用到上限後背景工作先停、最後只留給用戶查詢
+    "google": _limits("google", 50, 100, 0),
+    "cwa": _limits("cwa", 5, 10, 0),
+    # Nominatim 的限制是對整個來源 IP，多個 worker 必須合計
+    "nominatim": _limits("nominatim", 1 / NOMINATIM_MIN_INTERVAL if NOMINATIM_MIN_INTERVAL > 0 else 0, 1, 0,
+                         shared=True),
+}
+
+
+class QuotaExceededError(Exception):
+    pass
+
+
+def current_priority():
+    return _priority.get()
+
+
+# 背景工作以 with quota.priority(quota.PREWARM): 包住，其中的上游呼叫都以該優先順序排隊
+@contextmanager
+def priority(level):
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+# 令牌桶：令牌不足時依優先順序排隊，同優先順序先到先得；rate 為 0 時不限速
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._waiters = []  # (優先順序, 序號)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, level=INTERACTIVE, timeout=QUOTA_MAX_WAIT):
+        if self.rate <= 0:
+            return True
+        with self._cond:
+            entry = (level, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            deadline = time.monotonic() + timeout
+            while True:
+                self._refill()
+                if self._waiters[0] == entry and self._tokens >= 1:
+                    heapq.heappop(self._waiters)
+                    self._tokens -= 1
+                    self._cond.notify_all()
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(min(remaining, max((1 - self._tokens) / self.rate, 0.001)))
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+# 多個 worker 共用的速率限制：SQLite 記錄下一個可用的時間點，每次預約一格（1/rate 秒）後等到該時間才呼叫。
+# 預約以單一 UPDATE 完成，多個 worker 同時預約也不會拿到同一格；要等超過 timeout 的不預約
+class SharedRateLimit:
+    def __init__(self, name, rate, burst, path=QUOTA_DB_PATH):
+        self.name = name
+        self.interval = 1 / rate if rate > 0 else 0
+        self.window = self.interval * (max(burst, 1) - 1)  # 閒置時最多可預先累積的量
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS rate_slots (upstream TEXT PRIMARY KEY, next_at REAL NOT NULL)"
+            )
+            self._db.execute("INSERT OR IGNORE INTO rate_slots (upstream, next_at) VALUES (?, 0)", (name,))
+
+    def acquire(self, timeout=QUOTA_MAX_WAIT):
+        if self.interval <= 0:
+            return True
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute(
+                "UPDATE rate_slots SET next_at = max(next_at, ?) + ? "
+                "WHERE upstream = ? AND max(next_at, ?) - ? <= ? RETURNING next_at - ?",
+                (now - self.window, self.interval, self.name, now - self.window, now, timeout, self.interval)
+            ).fetchone()
+        if row is None:
+            return False
+        if row[0] > now:
+            time.sleep(row[0] - now)
+        return True
+
+
+# 每日用量，以本地日期為單位；用 UPDATE ... WHERE used + cost <= 上限 讓多個 worker 同時扣額度也不會超過
+class DailyBudget:
+    def __init__(self, path=QUOTA_DB_PATH):
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS quota ("
+                "upstream TEXT NOT NULL, day TEXT NOT NULL, used INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (upstream, day))"
+            )
+            self._db.execute("DELETE FROM quota WHERE day < date('now', 'localtime', '-30 days')")
+
+    def spend(self, upstream, cost, limit):
+        day = time.strftime("%Y-%m-%d")
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO quota (upstream, day) VALUES (?, ?)", (upstream, day))
+            cursor = self._db.execute(
+                "UPDATE quota SET used = used + ? WHERE upstream = ? AND day = ? AND used + ? <= ?",
+                (cost, upstream, day, cost, limit)
+            )
+            return cursor.rowcount > 0
+
+    def used(self, upstream):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT used FROM quota WHERE upstream = ? AND day = ?", (upstream, time.strftime("%Y-%m-%d"))
+            ).fetchone()
+        return row[0] if row else 0
+
+
+# 上游呼叫前先取得令牌並扣每日額度；額度快用完時 low() 為 True，呼叫端改用快取或較粗略的結果
+class QuotaManager:
+    def __init__(self, limits=LIMITS, path=QUOTA_DB_PATH):
+        self.limits = limits
+        self.buckets = {name: TokenBucket(limit["rate"], limit["burst"]) for name, limit in limits.items()}
+        # 共用速率的上游：行程內的令牌桶先依優先順序排隊，再到 SQLite 預約所有 worker 共用的時間格
+        self.shared = {
+            name: SharedRateLimit(name, limit["rate"], limit["burst"], path)
+            for name, limit in limits.items() if limit.get("shared") and limit["rate"] > 0
+        }
+        self.budget = DailyBudget(path) if any(limit["daily_budget"] for limit in limits.values()) else None
+
+    def acquire(self, upstream, cost=1):
+        limit = self.limits.get(upstream)
+        if limit is None:
+            return
+        level = current_priority()
+        labels = {"upstream": upstream, "priority": PRIORITY_NAMES[level]}
+
+        started = time.perf_counter()
+        shared = self.shared.get(upstream)
+        if not self.buckets[upstream].acquire(level) or (
+                shared is not None and not shared.acquire(QUOTA_MAX_WAIT - (time.perf_counter() - started))):
+            metrics.inc("quota_rejected_total", reason="rate", **labels)
+            raise QuotaExceededError(f"{upstream} 請求過多，等待超過 {QUOTA_MAX_WAIT} 秒")
+        metrics.observe("quota_wait_seconds", time.perf_counter() - started, **labels)
+
+        if limit["daily_budget"]:
+            allowed = int(limit["daily_budget"] * PRIORITY_SHARE[level])
+            if not self.budget.spend(upstream, cost, allowed):
+                metrics.inc("quota_rejected_total", reason="budget", **labels)
+                raise QuotaExceededError(f"{upstream} 今日額度已用到 {allowed} 次上限（{labels['priority']}）")
+        metrics.inc("quota_spent_total", cost, **labels)
+
+    # 剩餘額度低於保留比例：背景工作已停止，用戶查詢也應盡量改用快取
+    def low(self, upstream):
+        limit = self.limits.get(upstream)
+        if not limit or not limit["daily_budget"]:
+            return False
+        return self.budget.used(upstream) >= limit["daily_budget"] * (1 - QUOTA_RESERVE)
+
+    def usage(self):
+        return {
+            name: {"used": self.budget.used(name), "daily_budget": limit["daily_budget"]}
+            for name, limit in self.limits.items() if limit["daily_budget"]
+        }
+
+
+manager = QuotaManager()
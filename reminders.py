@@ -0,0 +1,251 @@
+import os
+import time
+import logging
+import sqlite3
+import threading
+from functools import partial
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import quota
+from CommuteBot import get_commute_info
+from delivery import DeliveryBatch
+from WeatherBot import get_city_and_district, get_weather
+
+logger = logging.getLogger(__name__)
+
+REMINDER_DB_PATH = os.getenv('REMINDER_DB_PATH', 'reminders.sqlite3')
+REMINDER_LEAD_MINUTES = int(os.getenv('REMINDER_LEAD_MINUTES', 15))  # 出發前幾分鐘提醒
+REMINDER_PREWARM_MINUTES = int(os.getenv('REMINDER_PREWARM_MINUTES', 10))  # 提醒前幾分鐘先更新快取
+REMINDER_TICK_SECONDS = int(os.getenv('REMINDER_TICK_SECONDS', 30))
+REMINDER_BATCH_SIZE = int(os.getenv('REMINDER_BATCH_SIZE', 500))  # 每次領取的提醒數，一輪會領到沒有到期的為止
+REMINDER_MAX_ATTEMPTS = int(os.getenv('REMINDER_MAX_ATTEMPTS', 3))  # 發送失敗時最多嘗試幾次
+REMINDER_RETRY_SECONDS = int(os.getenv('REMINDER_RETRY_SECONDS', 60))  # 發送失敗後隔多久再試
+REMINDER_SEND_LEASE = int(os.getenv('REMINDER_SEND_LEASE', 300))  # 發送中超過幾秒沒有結果，視為 worker 已中斷
+REMINDER_KEEP_DAYS = int(os.getenv('REMINDER_KEEP_DAYS', 7))  # 已發送或放棄的提醒保留幾天
+
+# prewarmed 欄位：0 未處理、1 已預先查詢、2 某個 worker 正在預先查詢
+PREWARM_PENDING, PREWARM_DONE, PREWARM_CLAIMED = 0, 1, 2
+# sent 欄位：0 未發送、1 已發送、2 某個 worker 正在發送、3 重試多次仍失敗而放棄
+SEND_PENDING, SEND_DONE, SEND_CLAIMED, SEND_FAILED = 0, 1, 2, 3
+
+
+def _timestamp(datetime_str):
+    return time.mktime(time.strptime(datetime_str, "%Y-%m-%d %H:%M"))
+
+
+# 通勤提醒排程：提醒存在 SQLite，由單一個定時工作批次處理到期與即將到期的提醒，
+# 不會替每筆提醒各開一個計時器。
+class ReminderScheduler:
+    def __init__(self, multicast, path=REMINDER_DB_PATH, lead_minutes=REMINDER_LEAD_MINUTES,
+                 prewarm_minutes=REMINDER_PREWARM_MINUTES):
+        self.multicast = multicast  # multicast(user_ids, text)
+        self.path = path
+        self.lead = lead_minutes * 60
+        self.prewarm_window = prewarm_minutes * 60
+        self._local = threading.local()
+        self._scheduler = None
+        with self._db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS reminders ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+                "origin TEXT NOT NULL, destination TEXT NOT NULL, mode TEXT NOT NULL, "
+                "time_type TEXT NOT NULL, datetime TEXT NOT NULL, departure_time TEXT NOT NULL, "
+                "remind_at REAL NOT NULL, prewarmed INTEGER NOT NULL DEFAULT 0, "
+                "sent INTEGER NOT NULL DEFAULT 0, attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            # 舊版資料表沒有 attempts 欄位
+            if "attempts" not in {row[1] for row in db.execute("PRAGMA table_info(reminders)")}:
+                db.execute("ALTER TABLE reminders ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+            db.execute("CREATE INDEX IF NOT EXISTS reminders_due ON reminders (sent, remind_at)")
+
+    # 新增提醒；同一用戶只保留最新一筆尚未發送的提醒
+    def add(self, user_id, user_data, commute_result):
+        departure_time = commute_result['best_departure_time']
+        remind_at = max(_timestamp(departure_time) - self.lead, time.time())
+        with self._db() as db:
+            db.execute("DELETE FROM reminders WHERE user_id = ? AND sent = 0", (user_id,))
+            db.execute(
+                "INSERT INTO reminders (user_id, origin, destination, mode, time_type, datetime, "
+                "departure_time, remind_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, user_data['origin'], user_data['destination'], user_data['mode'],
+                 user_data['time_type'], user_data['datetime'], departure_time, remind_at)
+            )
+
+    def start(self, scheduler=None):
+        if self._scheduler is not None:
+            return self._scheduler
+        if scheduler is None:
+            scheduler = BackgroundScheduler(daemon=True)
+        # 發送與預先查詢分成兩個工作，預先查詢較慢時不會延後發送
+        scheduler.add_job(
+            self.send_tick, 'interval', seconds=REMINDER_TICK_SECONDS,
+            id='reminder_tick', replace_existing=True, coalesce=True, max_instances=1
+        )
+        scheduler.add_job(
+            self.prewarm_tick, 'interval', seconds=REMINDER_TICK_SECONDS,
+            id='reminder_prewarm', replace_existing=True, coalesce=True, max_instances=1
+        )
+        if not scheduler.running:
+            scheduler.start()
+        self._scheduler = scheduler
+        return scheduler
+
+    def send_tick(self):
+        try:
+            self.send_due(time.time())
+        except Exception:
+            logger.exception("發送通勤提醒失敗")
+
+    def prewarm_tick(self):
+        try:
+            self.prewarm_due(time.time())
+        except Exception:
+            logger.exception("預先更新通勤提醒資料失敗")
+
+    # 即將提醒的批次先查一次路況與天氣，寫進各 worker 共用的快取（路線與地理編碼的 SQLite、預報快照），
+    # 之後由哪個 worker 發送都讀得到；相同路線只查一次，查完才標記為已預先查詢。順便清掉保留期已過的提醒
+    def prewarm_due(self, now):
+        self.purge(now)
+        total = routes = 0
+        while True:
+            rows = self._claim_prewarm(now + self.prewarm_window)
+            if not rows:
+                break
+            distinct = {reminder_key(reminder): reminder for reminder in rows}
+            try:
+                for reminder in distinct.values():
+                    compose_reminder(reminder, quota.PREWARM)
+            except BaseException:
+                self._set_prewarmed(rows, PREWARM_PENDING)
+                raise
+            self._set_prewarmed(rows, PREWARM_DONE)
+            total += len(rows)
+            routes += len(distinct)
+        if total:
+            logger.info(f"已預先更新 {total} 筆通勤提醒（{routes} 條路線）的路況與天氣")
+        return total
+
+    # 到期的提醒依路線分組，每組只組一次訊息並以 multicast 發送；一批一批領取直到沒有到期的提醒。
+    # 訊息組不出來或 multicast 失敗的提醒稍後重試，超過 REMINDER_MAX_ATTEMPTS 次才放棄
+    def send_due(self, now):
+        groups = calls = 0
+        while True:
+            rows = self._claim_send(now)
+            if not rows:
+                break
+            batch = DeliveryBatch(self.multicast)
+            for reminder in rows:
+                batch.add(reminder['user_id'], reminder_key(reminder), partial(compose_reminder, reminder))
+            sent = batch.flush()
+            self._finish_send(rows, set(batch.failed), now)
+            groups += sent[0]
+            calls += sent[1]
+        return groups, calls
+
+    # 刪除 REMINDER_KEEP_DAYS 天前已發送或放棄的提醒
+    def purge(self, now):
+        with self._db() as db:
+            cursor = db.execute(
+                "DELETE FROM reminders WHERE sent IN (?, ?) AND remind_at <= ?",
+                (SEND_DONE, SEND_FAILED, now - REMINDER_KEEP_DAYS * 86400)
+            )
+        if cursor.rowcount:
+            logger.info(f"已刪除 {cursor.rowcount} 筆過期的通勤提醒")
+        return cursor.rowcount
+
+    # 即將到期、還沒預先查詢的提醒
+    def _claim_prewarm(self, due):
+        return self._claim(
+            "prewarmed = ?", (PREWARM_CLAIMED,),
+            "sent = ? AND prewarmed = ? AND remind_at <= ?", (SEND_PENDING, PREWARM_PENDING, due)
+        )
+
+    # 到期的提醒，以及發送中超過 REMINDER_SEND_LEASE 秒仍沒有結果（worker 中斷）的提醒
+    def _claim_send(self, now):
+        return self._claim(
+            "sent = ?", (SEND_CLAIMED,),
+            "(sent = ? OR (sent = ? AND remind_at <= ?)) AND remind_at <= ?",
+            (SEND_PENDING, SEND_CLAIMED, now - REMINDER_SEND_LEASE, now)
+        )
+
+    # 符合 where 的提醒依 remind_at 取 REMINDER_BATCH_SIZE 筆更新並回傳；
+    # 單一 UPDATE ... RETURNING 完成，多個 worker 同時執行也不會領到同一筆
+    def _claim(self, assignments, values, where, args):
+        db = self._db()
+        db.row_factory = sqlite3.Row
+        with db:
+            rows = db.execute(
+                f"UPDATE reminders SET {assignments} WHERE id IN ("
+                f"SELECT id FROM reminders WHERE {where} ORDER BY remind_at LIMIT ?) RETURNING *",
+                (*values, *args, REMINDER_BATCH_SIZE)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    # 成功的標記為已發送；失敗的延後 REMINDER_RETRY_SECONDS 秒再試，次數用完標記為放棄
+    def _finish_send(self, rows, failed, now):
+        done, retry, give_up = [], [], []
+        for reminder in rows:
+            if reminder['user_id'] not in failed:
+                done.append((SEND_DONE, reminder['id']))
+            elif reminder['attempts'] + 1 < REMINDER_MAX_ATTEMPTS:
+                retry.append((SEND_PENDING, now + REMINDER_RETRY_SECONDS, reminder['id']))
+            else:
+                give_up.append((SEND_FAILED, reminder['id']))
+        with self._db() as db:
+            db.executemany("UPDATE reminders SET sent = ? WHERE id = ?", done)
+            db.executemany("UPDATE reminders SET sent = ?, attempts = attempts + 1 WHERE id = ?", give_up)
+            db.executemany(
+                "UPDATE reminders SET sent = ?, remind_at = ?, attempts = attempts + 1 WHERE id = ?", retry
+            )
+        if retry or give_up:
+            logger.warning(f"通勤提醒發送失敗：{len(retry)} 筆稍後重試，{len(give_up)} 筆已放棄")
+
+    def _set_prewarmed(self, rows, state):
+        with self._db() as db:
+            db.executemany("UPDATE reminders SET prewarmed = ? WHERE id = ?", [(state, r['id']) for r in rows])
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10)
+            self._local.db = db
+        return db
+
+
+# 會影響提醒內容的輸入，相同的提醒可以共用同一則訊息
+def reminder_key(reminder):
+    return (reminder['origin'], reminder['destination'], reminder['mode'],
+            reminder['time_type'], reminder['datetime'])
+
+
+# 依最新路況與天氣組出提醒訊息；上游呼叫的優先順序低於用戶查詢，額度不足時沿用排定的出發時間
+def compose_reminder(reminder, level=quota.REMINDER):
+    with quota.priority(level):
+        return _compose_reminder(reminder)
+
+
+def _compose_reminder(reminder):
+    commute_result = get_commute_info(
+        reminder['origin'], reminder['destination'], reminder['datetime'],
+        reminder['mode'], reminder['time_type']
+    )
+    if "error" in commute_result:
+        departure_time = reminder['departure_time']
+        duration_text = "暫時無法取得最新路況"
+    else:
+        departure_time = commute_result['best_departure_time']
+        duration_text = commute_result['duration_text']
+
+    origin_info = get_city_and_district(reminder['origin'])
+    weather = get_weather(origin_info["city"], origin_info["district"], departure_time.replace(" ", "T"), False)
+
+    return f"""⏰ 通勤提醒
+━━━━━━━━━━━━━━
+📍 出發地：{reminder['origin']}
+🏁 目的地：{reminder['destination']}
+🚪 建議出發時間：{departure_time}
+⏱ 預估通勤時間：{duration_text}
+🌤 出發地天氣：
+{weather}"""
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import mimetypes
+
+from linebot import LineBotApi
+from linebot.exceptions import LineBotApiError
+from linebot.models import (
+    RichMenu, RichMenuArea, RichMenuBounds, RichMenuSize, MessageAction
+)
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+RICH_MENU_IMAGE = os.getenv('RICH_MENU_IMAGE', os.path.join(os.path.dirname(os.path.abspath(__file__)), '111.png'))
+# 選單名稱後面附上定義與圖片的雜湊，用來判斷 LINE 上的選單是否已是最新版本
+HASH_SEPARATOR = " #"
+
+
+def create_rich_menu(name="功能選單"):
+    rich_menu = RichMenu(
+        size=RichMenuSize(width=2500, height=843),
+        selected=True,
+        name=name,
+        chat_bar_text="點擊開啟選單",
+        areas=[
+            RichMenuArea(
+                bounds=RichMenuBounds(x=0, y=0, width=1250, height=843),
+                action=MessageAction(label='切換到天氣查詢', text='切換到天氣查詢')
+            ),
+            RichMenuArea(
+                bounds=RichMenuBounds(x=1250, y=0, width=1250, height=843),
+                action=MessageAction(label='設定通勤', text='設定通勤')
+            )
+        ]
+    )
+    return rich_menu
+
+
+def menu_hash(rich_menu, image):
+    digest = hashlib.sha256(json.dumps(rich_menu.as_json_dict(), sort_keys=True, ensure_ascii=False).encode())
+    digest.update(image)
+    return digest.hexdigest()[:12]
+
+
+# 讓 LINE 上的預設選單與 create_rich_menu() 及圖片一致，只呼叫有差異的部分：
+# 已有相同雜湊的選單就沿用，否則建立並上傳圖片；最後刪除同名的舊版選單。
+# 回傳預設選單的 ID 與做過的變更。
+def sync_rich_menu(line_bot_api, image_path=RICH_MENU_IMAGE):
+    definition = create_rich_menu()
+    with open(image_path, 'rb') as f:
+        image = f.read()
+    base_name = definition.name
+    definition.name = f"{base_name}{HASH_SEPARATOR}{menu_hash(definition, image)}"
+    changes = []
+
+    # 舊版啟動程式每次建立的同名選單也一併清掉
+    managed = [menu for menu in line_bot_api.get_rich_menu_list()
+               if menu.name == base_name or menu.name.startswith(base_name + HASH_SEPARATOR)]
+    current = next((menu.rich_menu_id for menu in managed if menu.name == definition.name), None)
+    if current is None:
+        current = line_bot_api.create_rich_menu(definition)
+        content_type = mimetypes.guess_type(image_path)[0] or "image/png"
+        line_bot_api.set_rich_menu_image(current, content_type, image)
+        changes.append(f"建立選單 {definition.name}")
+
+    try:
+        default = line_bot_api.get_default_rich_menu()
+    except LineBotApiError as e:
+        if e.status_code != 404:
+            raise
+        default = None
+    if default != current:
+        line_bot_api.set_default_rich_menu(current)
+        changes.append("設為預設選單")
+
+    for menu in managed:
+        if menu.rich_menu_id != current:
+            line_bot_api.delete_rich_menu(menu.rich_menu_id)
+            changes.append(f"刪除舊選單 {menu.name}")
+
+    if changes:
+        logger.info(f"Rich Menu 已同步（{current}）：{'、'.join(changes)}")
+    else:
+        logger.info(f"Rich Menu 已是最新版本（{current}）")
+    return current, changes
+
+
+def default_line_api():
+    return LineBotApi(
+        os.getenv('LINE_CHANNEL_ACCESS_TOKEN'),
+        endpoint=os.getenv('LINE_API_ENDPOINT', LineBotApi.DEFAULT_API_ENDPOINT)
+    )
+
+
+# 同步指令：python rich_menu.py
+if __name__ == "__main__":
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sync_rich_menu(default_line_api(), os.getenv('RICH_MENU_IMAGE', RICH_MENU_IMAGE))
+    sys.exit(0)
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from geocache import normalize_place
+
+ROUTE_CACHE_PATH = os.getenv('ROUTE_CACHE_PATH', 'route_cache.sqlite3')  # 設為空字串時只用行程內快取
+ROUTE_CACHE_TTL = int(os.getenv('ROUTE_CACHE_TTL', 60 * 15))
+ROUTE_CACHE_BUCKET = int(os.getenv('ROUTE_CACHE_BUCKET', 60 * 5))  # 出發時間以 5 分鐘為一格
+ROUTE_CACHE_SIZE = int(os.getenv('ROUTE_CACHE_SIZE', 4096))
+ROUTE_CACHE_STALE = int(os.getenv('ROUTE_CACHE_STALE', 60 * 60 * 2))  # 額度不足時，過期多久內的結果仍可沿用
+ROUTE_CACHE_NEAREST = int(os.getenv('ROUTE_CACHE_NEAREST', 3))  # 額度不足時，前後幾個時間格的結果也可沿用
+
+
+# Distance Matrix 查詢結果快取，鍵為 (出發地, 目的地, 交通方式, 時間類型, 時間格)。
+# 兩層：行程內 LRU + SQLite，同一台主機的 worker 共用（例如提醒預先查詢的路況，發送的 worker 也讀得到）
+class RouteCache:
+    def __init__(self, ttl=ROUTE_CACHE_TTL, bucket=ROUTE_CACHE_BUCKET, maxsize=ROUTE_CACHE_SIZE,
+                 stale=ROUTE_CACHE_STALE, path=ROUTE_CACHE_PATH):
+        self.ttl = ttl
+        self.stale = stale
+        self.bucket = bucket
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS routes ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM routes WHERE expires_at <= ?", (time.time() - stale,))
+            self._db.commit()
+
+    def key(self, origin, destination, mode, time_type, timestamp):
+        return (
+            normalize_place(origin), normalize_place(destination),
+            mode, time_type, int(timestamp) // self.bucket
+        )
+
+    def get(self, key):
+        with self._lock:
+            item = self._lookup(key)
+            if item is not None and item[1] > time.time():
+                self.hits += 1
+                return item[0]
+            self.misses += 1
+            return None
+
+    # 額度不足時的退路：同一路線在前後 span 個時間格內、過期不超過 stale 秒的結果，越近的時間格越優先
+    def nearest(self, key, span=ROUTE_CACHE_NEAREST):
+        with self._lock:
+            for offset in sorted(range(-span, span + 1), key=abs):
+                item = self._lookup(key[:4] + (key[4] + offset,))
+                if item is not None:
+                    return item[0]
+        return None
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO routes (key, value, expires_at) VALUES (?, ?, ?)",
+                    (json.dumps(key, ensure_ascii=False), json.dumps(value, ensure_ascii=False), expires_at)
+                )
+                # 偶爾順便清掉過期太久的資料
+                self._writes += 1
+                if self._writes % 1000 == 0:
+                    self._db.execute("DELETE FROM routes WHERE expires_at <= ?", (time.time() - self.stale,))
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    # 回傳 (value, expires_at)，過期超過 stale 秒的不回傳；行程內的資料過期時再看其他 worker 是否寫入了較新的
+    def _lookup(self, key):
+        now = time.time()
+        item = self._items.get(key)
+        if item is not None and item[1] > now:
+            self._items.move_to_end(key)
+            return item
+        if self._db is not None:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM routes WHERE key = ?", (json.dumps(key, ensure_ascii=False),)
+            ).fetchone()
+            if row is not None and (item is None or row[1] > item[1]):
+                item = self._remember(key, json.loads(row[0]), row[1])
+        if item is None:
+            return None
+        if item[1] + self.stale <= now:
+            self._items.pop(key, None)
+            return None
+        return item
+
+    def _remember(self, key, value, expires_at):
+        item = self._items[key] = (value, expires_at)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return item
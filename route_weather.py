@@ -0,0 +1,134 @@
+import os
+import math
+import time
+
+import quota
+from CommuteBot import query_directions
+from WeatherBot import gazetteer, get_weather_batch
+
+ROUTE_WEATHER = os.getenv('ROUTE_WEATHER', '1') == '1'
+ROUTE_SAMPLE_KM = float(os.getenv('ROUTE_SAMPLE_KM', 3))  # 沿路線每隔幾公里取一個點
+ROUTE_MAX_STOPS = int(os.getenv('ROUTE_MAX_STOPS', 12))  # 回覆中最多列出幾個鄉鎮
+
+
+# Google encoded polyline -> [(lat, lon), ...]
+def decode_polyline(points):
+    coordinates = []
+    index = lat = lon = 0
+    while index < len(points):
+        deltas = []
+        for _ in range(2):
+            shift = result = 0
+            while True:
+                byte = ord(points[index]) - 63
+                index += 1
+                result |= (byte & 0x1f) << shift
+                shift += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(result >> 1) if result & 1 else result >> 1)
+        lat += deltas[0]
+        lon += deltas[1]
+        coordinates.append((lat / 1e5, lon / 1e5))
+    return coordinates
+
+
+def _distance_km(a, b):
+    lat1, lon1, lat2, lon2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371 * 2 * math.asin(math.sqrt(h))
+
+
+# 沿 Directions 的各路段每隔 every_km 取樣，回傳 [(lat, lon, 預計經過的 timestamp), ...]。
+# 路段內的時間依距離比例分配該路段的耗時。
+def sample_route(steps, departure, every_km=ROUTE_SAMPLE_KM):
+    samples = []
+    last_point = None
+    step_start = departure
+    travelled = 0.0
+    next_sample = 0.0
+    for step in steps:
+        points = decode_polyline(step['polyline']['points'])
+        duration = step['duration']['value']
+        lengths = [_distance_km(a, b) for a, b in zip(points, points[1:])]
+        total = sum(lengths)
+        covered = 0.0
+        for (a, b), length in zip(zip(points, points[1:]), lengths):
+            while travelled + length >= next_sample:
+                fraction = (next_sample - travelled) / length if length else 0.0
+                at = step_start + (duration * (covered + fraction * length) / total if total else 0)
+                samples.append((a[0] + (b[0] - a[0]) * fraction, a[1] + (b[1] - a[1]) * fraction, at))
+                next_sample += every_km
+            travelled += length
+            covered += length
+        step_start += duration
+        if points:
+            last_point = points[-1]
+    if last_point is not None:
+        samples.append((last_point[0], last_point[1], step_start))
+    return samples
+
+
+# 取樣點對應到的鄉鎮，連續相同的只保留第一次進入的時間
+def townships_along(samples, locate):
+    stops = []
+    for lat, lon, at in samples:
+        township = locate(lat, lon)
+        if township is None or (stops and stops[-1][:2] == township):
+            continue
+        stops.append((township[0], township[1], at))
+    return stops
+
+
+def _thin(stops, limit):
+    if len(stops) <= limit:
+        return stops
+    step = (len(stops) - 1) / (limit - 1)
+    return [stops[round(i * step)] for i in range(limit)]
+
+
+# 沿途天氣：依路線經過的鄉鎮與預計經過時間批次查詢天氣。
+# 經過的鄉鎮需要 gazetteer 的界線資料，沒有中途鄉鎮時回傳 None（起訖點天氣已在回覆中）。
+def route_timeline(origin, destination, mode, origin_info, dest_info, commute):
+    # 額度快用完時省下 Directions 的呼叫
+    if "error" in commute or not gazetteer.has_boundaries or quota.manager.low('google'):
+        return None
+    departure = time.mktime(time.strptime(commute['best_departure_time'], "%Y-%m-%d %H:%M"))
+    response = query_directions(origin, destination, mode, int(departure))
+    if response.get('status') != 'OK' or not response.get('routes'):
+        return None
+    steps = [step for leg in response['routes'][0]['legs'] for step in leg['steps']]
+
+    samples = sample_route(steps, departure)
+    # 依 Distance Matrix 的通勤時間（含路況）等比例調整經過時間
+    planned = sum(step['duration']['value'] for step in steps)
+    if planned and commute.get('duration_minutes'):
+        scale = commute['duration_minutes'] * 60 / planned
+        samples = [(lat, lon, departure + (at - departure) * scale) for lat, lon, at in samples]
+    stops = townships_along(samples, gazetteer.locate)
+
+    # 起訖點以已解析的鄉鎮為準
+    arrival = samples[-1][2] if samples else departure
+    if "error" not in origin_info and (not stops or stops[0][:2] != (origin_info["city"], origin_info["district"])):
+        stops.insert(0, (origin_info["city"], origin_info["district"], departure))
+    if "error" not in dest_info and (not stops or stops[-1][:2] != (dest_info["city"], dest_info["district"])):
+        stops.append((dest_info["city"], dest_info["district"], arrival))
+    if len(stops) < 3:
+        return None
+
+    stops = _thin(stops, ROUTE_MAX_STOPS)
+    texts = get_weather_batch([
+        (city, district, time.strftime("%Y-%m-%dT%H:%M", time.localtime(at))) for city, district, at in stops
+    ])
+    return [
+        {"time": time.strftime("%H:%M", time.localtime(at)), "city": city, "district": district,
+         "weather": text.replace("\n", "，")}
+        for (city, district, at), text in zip(stops, texts)
+    ]
+
+
+def format_timeline(timeline):
+    lines = ["🛣 沿途天氣："]
+    for stop in timeline:
+        lines.append(f"{stop['time']} {stop['city']}{stop['district']}：{stop['weather']}")
+    return "\n".join(lines)
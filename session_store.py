@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory')  # memory / sqlite / redis
+SESSION_TTL = int(os.getenv('SESSION_TTL', 60 * 60 * 24))  # 一天沒互動就清除對話狀態
+SESSION_MAX = int(os.getenv('SESSION_MAX', 10000))
+SESSION_DB_PATH = os.getenv('SESSION_DB_PATH', 'sessions.sqlite3')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+
+
+def new_session():
+    return {"state": "start", "data": {}}
+
+
+# 對話狀態儲存介面：每位用戶一份 {"state": ..., "data": {...}}
+class SessionStore:
+    def get(self, user_id):
+        raise NotImplementedError
+
+    def set(self, user_id, session):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+    # 原子地讀取並更新：fn 收到目前的 session 並回傳新的 session。
+    # 共用後端在衝突時可能重跑 fn，因此 fn 不應有其他副作用。
+    def update(self, user_id, fn):
+        raise NotImplementedError
+
+    def reset(self, user_id):
+        self.set(user_id, new_session())
+
+
+# 行程內的後端：TTL 到期或超過上限時淘汰最久沒用到的用戶
+class MemorySessionStore(SessionStore):
+    def __init__(self, ttl=SESSION_TTL, maxsize=SESSION_MAX):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items = OrderedDict()  # user_id -> (state, data, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            return self._load(user_id)
+
+    def set(self, user_id, session):
+        with self._lock:
+            self._store(user_id, session)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+
+    def update(self, user_id, fn):
+        with self._lock:
+            session = fn(self._load(user_id))
+            self._store(user_id, session)
+            return session
+
+    def _load(self, user_id):
+        item = self._items.get(user_id)
+        if item is None or item[2] <= time.time():
+            self._items.pop(user_id, None)
+            return new_session()
+        return {"state": item[0], "data": json.loads(item[1])}
+
+    def _store(self, user_id, session):
+        # data 以 JSON 字串保存，避免呼叫端持有的 dict 被意外共用
+        self._items[user_id] = (session["state"], json.dumps(session["data"], ensure_ascii=False), time.time() + self.ttl)
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+
+# SQLite（WAL 模式）後端，同一台主機上的多個 gunicorn worker 可共用
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def get(self, user_id):
+        return self._load(self._db(), user_id)
+
+    def set(self, user_id, session):
+        with self._db() as db:
+            self._store(db, user_id, session)
+
+    def delete(self, user_id):
+        with self._db() as db:
+            db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def update(self, user_id, fn):
+        db = self._db()
+        # BEGIN IMMEDIATE 先取得寫入鎖，讀取與寫回之間不會被其他行程插隊
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            session = fn(self._load(db, user_id))
+            self._store(db, user_id, session)
+            db.execute("COMMIT")
+            return session
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _db(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA busy_timeout = 10000")
+            self._local.db = db
+        return db
+
+    def _load(self, db, user_id):
+        row = db.execute(
+            "SELECT value FROM sessions WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else new_session()
+
+    def _store(self, db, user_id, session):
+        db.execute(
+            "INSERT OR REPLACE INTO sessions (user_id, value, expires_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(session, ensure_ascii=False), time.time() + self.ttl)
+        )
+        # 偶爾順便清掉過期的資料
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            db.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+
+# Redis 協定後端，可跨多台主機共用；client 可換成任何相容的實作（例如測試用的替身）
+class RedisSessionStore(SessionStore):
+    def __init__(self, client=None, ttl=SESSION_TTL, prefix="session:"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(REDIS_URL)
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, user_id):
+        value = self.client.get(self.prefix + user_id)
+        return json.loads(value) if value else new_session()
+
+    def set(self, user_id, session):
+        self.client.set(self.prefix + user_id, json.dumps(session, ensure_ascii=False), ex=self.ttl)
+
+    def delete(self, user_id):
+        self.client.delete(self.prefix + user_id)
+
+    def update(self, user_id, fn):
+        key = self.prefix + user_id
+        result = {}
+
+        # WATCH/MULTI 樂觀鎖，期間被其他 worker 改過就重跑
+        def transaction(pipe):
+            value = pipe.get(key)
+            session = fn(json.loads(value) if value else new_session())
+            pipe.multi()
+            pipe.set(key, json.dumps(session, ensure_ascii=False), ex=self.ttl)
+            result["session"] = session
+
+        self.client.transaction(transaction, key)
+        return result["session"]
+
+
+def create_session_store(backend=SESSION_BACKEND):
+    if backend == 'sqlite':
+        return SQLiteSessionStore()
+    if backend == 'redis':
+        return RedisSessionStore()
+    return MemorySessionStore()
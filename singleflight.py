@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows 沒有 flock，只做行程內合併
+    fcntl = None
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 相同的上游查詢同時只送出一次：同一行程內的其他請求直接等待結果；
+# 同一台主機的其他 worker 透過 SINGLEFLIGHT_DIR 下的鎖檔等待，設為空字串時只在行程內合併
+SINGLEFLIGHT_DIR = os.getenv('SINGLEFLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'amazingbot-singleflight'))
+SINGLEFLIGHT_TIMEOUT = float(os.getenv('SINGLEFLIGHT_TIMEOUT', 20))  # 每個等待者最多等幾秒
+SINGLEFLIGHT_LEASE = float(os.getenv('SINGLEFLIGHT_LEASE', 30))  # 其他 worker 持有鎖超過幾秒視為卡住，改為自己查詢
+SINGLEFLIGHT_POLL = 0.02
+SINGLEFLIGHT_SWEEP_AGE = 60 * 60  # 超過一小時沒用到的鎖檔會被清掉；結果檔超過 lease 秒就不會再被讀取，隨即清掉
+
+
+class SingleFlightTimeout(TimeoutError):
+    pass
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# 以正規化後的請求為鍵合併進行中的查詢。
+# share_results=True 時結果（需可轉成 JSON）會寫到鎖檔旁，其他 worker 等到鎖釋放後直接讀取；
+# 否則由呼叫端提供 recheck()，從共用的快取（SQLite、預報快照）取得其他 worker 剛寫入的結果。
+class SingleFlight:
+    def __init__(self, name, lock_dir=SINGLEFLIGHT_DIR, lease=SINGLEFLIGHT_LEASE, share_results=False):
+        self.name = name
+        self.lock_dir = lock_dir if fcntl is not None else ''
+        self.lease = lease
+        self.share_results = share_results
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        if self.lock_dir and not self._prepare_dir():
+            self.lock_dir = ''
+
+    # 共用結果含有用戶輸入的地址，目錄只給本帳號讀寫；目錄是其他帳號建立的（例如共用的 /tmp 被搶先建立）
+    # 或是符號連結時不使用，改為只在行程內合併
+    def _prepare_dir(self):
+        try:
+            os.makedirs(self.lock_dir, mode=0o700, exist_ok=True)
+            info = os.lstat(self.lock_dir)
+            if os.path.islink(self.lock_dir) or info.st_uid != os.getuid():
+                logger.warning(f"{self.lock_dir} 不是本帳號建立的目錄，{self.name} 只在行程內合併查詢")
+                return False
+            if info.st_mode & 0o077:
+                os.chmod(self.lock_dir, 0o700)
+            return True
+        except OSError:
+            logger.warning(f"無法使用 {self.lock_dir}，{self.name} 只在行程內合併查詢", exc_info=True)
+            return False
+
+    # fn() 的例外會傳給每個等待中的請求；等待超過 timeout 秒拋出 SingleFlightTimeout
+    def do(self, key, fn, timeout=SINGLEFLIGHT_TIMEOUT, recheck=None):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.inc("singleflight_requests_total", flight=self.name, result="coalesced")
+            if not call.event.wait(timeout):
+                metrics.inc("singleflight_requests_total", flight=self.name, result="timeout")
+                raise SingleFlightTimeout(f"等待 {self.name} 查詢 {key!r} 逾時")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run(key, fn, timeout, recheck)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def _run(self, key, fn, timeout, recheck):
+        if not self.lock_dir:
+            metrics.inc("singleflight_requests_total", flight=self.name, result="leader")
+            return fn()
+
+        path = os.path.join(self.lock_dir, f"{self.name}-{hashlib.sha1(repr(key).encode()).hexdigest()}")
+        started = time.time()
+        fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if not self._try_lock(fd):
+                # 其他 worker 正在查詢，等它釋放鎖後先看看有沒有留下結果
+                now = time.monotonic()
+                deadline, lease_end = now + timeout, now + self.lease
+                locked = False
+                while not locked and time.monotonic() < min(deadline, lease_end):
+                    time.sleep(SINGLEFLIGHT_POLL)
+                    locked = self._try_lock(fd)
+                if locked:
+                    shared = self._read_result(path, started)
+                    if shared is None and recheck is not None:
+                        shared = recheck()
+                    if shared is not None:
+                        metrics.inc("singleflight_requests_total", flight=self.name, result="shared")
+                        return shared
+                elif time.monotonic() >= deadline:
+                    metrics.inc("singleflight_requests_total", flight=self.name, result="timeout")
+                    raise SingleFlightTimeout(f"等待其他 worker 的 {self.name} 查詢 {key!r} 逾時")
+                else:
+                    logger.warning(f"{self.name} 的鎖被持有超過 {self.lease} 秒，改為自行查詢 {key!r}")
+
+            metrics.inc("singleflight_requests_total", flight=self.name, result="leader")
+            os.utime(fd)
+            result = fn()
+            if self.share_results:
+                self._write_result(path, result)
+            return result
+        finally:
+            os.close(fd)  # 關閉檔案同時釋放鎖，worker 異常結束時也會由系統釋放
+            self._sweep()
+
+    @staticmethod
+    def _try_lock(fd):
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    # 只接受開始等待之後寫入的結果
+    @staticmethod
+    def _read_result(path, since):
+        try:
+            if os.stat(path + ".json").st_mtime < since:
+                return None
+            with open(path + ".json", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_result(self, path, result):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp, path + ".json")
+        except (OSError, TypeError, ValueError):
+            logger.warning(f"寫入 {self.name} 的共用結果失敗", exc_info=True)
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    # 每 lease 秒清一次：結果檔與寫到一半的暫存檔過了 lease 就沒有等待者會讀，鎖檔保留較久
+    def _sweep(self):
+        now = time.time()
+        if now - self._last_sweep < self.lease:
+            return
+        self._last_sweep = now
+        prefix = self.name + "-"
+        try:
+            for entry in os.scandir(self.lock_dir):
+                if not entry.name.startswith(prefix):
+                    continue
+                max_age = SINGLEFLIGHT_SWEEP_AGE if entry.name.endswith(".lock") else self.lease
+                try:
+                    if now - entry.stat().st_mtime > max_age:
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    pass
+        except OSError:
+            pass
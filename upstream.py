@@ -0,0 +1,194 @@
+import os
+import time
+import random
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import quota
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# 各上游服務的位址、連線/讀取逾時、重試次數與斷路器設定，皆可用環境變數覆寫
+def _config(name, base_url, connect_timeout, read_timeout, retries, breaker_threshold=5, breaker_reset=30):
+    prefix = name.upper()
+    return {
+        "base_url": os.getenv(f'{prefix}_URL', base_url).rstrip("/"),
+        "timeout": (
+            float(os.getenv(f'{prefix}_CONNECT_TIMEOUT', connect_timeout)),
+            float(os.getenv(f'{prefix}_READ_TIMEOUT', read_timeout)),
+        ),
+        "retries": int(os.getenv(f'{prefix}_RETRIES', retries)),
+        # 連續失敗幾次後斷路，斷路幾秒後放一個請求試探
+        "breaker_threshold": int(os.getenv(f'{prefix}_BREAKER_THRESHOLD', breaker_threshold)),
+        "breaker_reset": float(os.getenv(f'{prefix}_BREAKER_RESET', breaker_reset)),
+    }
+
+
+UPSTREAMS = {
+    "nominatim": _config("nominatim", "https://nominatim.openstreetmap.org", 3.05, 10, 2),
+    "cwa": _config("cwa", "https://opendata.cwa.gov.tw", 3.05, 15, 2),
+    "google": _config("google", "https://maps.googleapis.com", 3.05, 10, 2),
+}
+
+POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', 10))
+RETRY_BACKOFF = float(os.getenv('UPSTREAM_RETRY_BACKOFF', 0.3))
+RETRY_JITTER = float(os.getenv('UPSTREAM_RETRY_JITTER', 0.2))
+RETRY_AFTER_MAX = float(os.getenv('UPSTREAM_RETRY_AFTER_MAX', 5))  # Retry-After 最多等幾秒，超過就不重試
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+# 斷路器：連續失敗（逾時、連線錯誤、5xx、429）達門檻後直接拒絕請求，不讓 worker 卡在有問題的上游；
+# 經過 reset_timeout 後只放一個試探請求，成功才恢復
+class CircuitBreaker:
+    def __init__(self, name, threshold, reset_timeout):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._probing or time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True
+            return True
+
+    # allow() 放行後沒有得到上游的結果（例如額度不足或其他例外），讓出試探的機會給下一個請求
+    def release(self):
+        with self._lock:
+            self._probing = False
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name} 已恢復，關閉斷路器")
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+        metrics.set_gauge("upstream_circuit_open", 0, upstream=self.name)
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is None and self._failures < self.threshold:
+                return
+            if self._opened_at is None:
+                logger.warning(f"{self.name} 連續失敗 {self._failures} 次，暫停呼叫 {self.reset_timeout} 秒")
+            self._opened_at = time.monotonic()
+        metrics.set_gauge("upstream_circuit_open", 1, upstream=self.name)
+
+
+breakers = {
+    name: CircuitBreaker(name, config["breaker_threshold"], config["breaker_reset"])
+    for name, config in UPSTREAMS.items()
+}
+
+
+# 每個上游共用一個 Session，保持 keep-alive 連線；重試由 get() 處理，每次重試都重新取得額度
+def session(name):
+    with _lock:
+        if name not in _sessions:
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=0)
+            s = requests.Session()
+            s.mount("https://", adapter)
+            s.mount("http://", adapter)
+            s.headers["Accept-Encoding"] = "gzip, deflate"
+            _sessions[name] = s
+        return _sessions[name]
+
+
+# 第 attempt 次重試前等待的秒數：指數退避加隨機抖動，避免多個 worker 同時重試；
+# 回應帶有 Retry-After 時以其為準，超過 RETRY_AFTER_MAX 回傳 None 表示不重試
+def _backoff(attempt, response=None):
+    delay = RETRY_BACKOFF * 2 ** (attempt - 1) + random.uniform(0, RETRY_JITTER)
+    retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+    if retry_after.isdigit():
+        if int(retry_after) > RETRY_AFTER_MAX:
+            return None
+        delay = max(delay, int(retry_after))
+    return delay
+
+
+def get(name, path, params=None, headers=None):
+    config = UPSTREAMS[name]
+    breaker = breakers[name]
+    # 先由斷路器決定是否放行，確定會呼叫上游才扣額度；斷路或半開時被擋下的請求不消耗額度
+    if not breaker.allow():
+        metrics.inc("upstream_errors_total", upstream=name, kind="circuit_open")
+        raise CircuitOpenError(f"{name} 暫時停止呼叫")
+    # 結果只有成功或失敗兩種會改變斷路器；其他例外（額度不足、SQLite 錯誤等）一律釋放試探機會，
+    # 不讓半開狀態卡住
+    healthy = None
+    try:
+        response = _request(name, config, path, params, headers)
+        healthy = response.status_code not in RETRY_STATUS
+        return response
+    except requests.RequestException:
+        healthy = False
+        raise
+    finally:
+        if healthy is True:
+            breaker.success()
+        elif healthy is False:
+            breaker.failure()
+        else:
+            breaker.release()
+
+
+# 逾時、連線錯誤、5xx 與 429 最多重試 retries 次；每次嘗試都各自扣額度與等待令牌，
+# 所以 Nominatim 的每秒限制與 Google 的每日額度都以實際送出的請求計算。
+# 重試時額度不足就停止重試，回傳最後一次的結果（或拋出最後一次的錯誤）
+def _request(name, config, path, params, headers):
+    quota.manager.acquire(name)
+    for attempt in range(1, config["retries"] + 2):
+        try:
+            with metrics.upstream_request(name) as result:
+                response = session(name).get(
+                    config["base_url"] + path, params=params, headers=headers, timeout=config["timeout"]
+                )
+                result["status"] = response.status_code
+            error = None
+        except (requests.ConnectionError, requests.Timeout) as e:
+            response, error = None, e
+        if error is None and response.status_code not in RETRY_STATUS:
+            return response
+
+        delay = _backoff(attempt, response) if attempt <= config["retries"] else None
+        if delay is None:
+            break
+        time.sleep(delay)
+        try:
+            quota.manager.acquire(name)
+        except quota.QuotaExceededError:
+            logger.warning(f"{name} 額度不足，停止重試")
+            break
+    if error is not None:
+        raise error
+    return response
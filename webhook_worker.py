@@ -0,0 +1,142 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from linebot.models import MessageEvent
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_ASYNC = os.getenv('WEBHOOK_ASYNC', '0') == '1'
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 8))
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', 1000))
+
+
+class QueueFullError(Exception):
+    pass
+
+
+# 以 key 分組的執行器：同一個 key 的工作依序執行，不同 key 之間平行處理
+class KeyedExecutor:
+    def __init__(self, max_workers=WEBHOOK_WORKERS, max_pending=WEBHOOK_MAX_PENDING):
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="webhook")
+        self._queues = {}  # key -> deque[(future, fn, args)]
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        return self.submit_many([(key, fn, args)])[0]
+
+    # 一次排入多個 (key, fn, args)：空間不足時一個都不排入並拋出 QueueFullError，
+    # 避免同一批 Webhook 只處理了一部分、LINE 重送時又重複處理前面的事件
+    def submit_many(self, jobs):
+        futures = []
+        started = []
+        with self._lock:
+            if self._pending + len(jobs) > self.max_pending:
+                raise QueueFullError(f"待處理事件已達上限 {self.max_pending}")
+            self._pending += len(jobs)
+            for key, fn, args in jobs:
+                future = Future()
+                futures.append(future)
+                queue = self._queues.get(key)
+                if queue is not None:
+                    # 該 key 已有工作在執行，排在後面即可
+                    queue.append((future, fn, args))
+                    continue
+                self._queues[key] = deque([(future, fn, args)])
+                started.append(key)
+        for key in started:
+            self._pool.submit(self._drain, key)
+        return futures
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                future, fn, args = queue.popleft()
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(fn(*args))
+            except Exception as e:
+                logger.exception(f"處理 {key} 的事件時發生錯誤")
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+# 事件來源：個人、群組或聊天室，用來保持同一來源的處理順序
+def event_key(event):
+    source = event.source
+    return (
+        getattr(source, "user_id", None) or
+        getattr(source, "group_id", None) or
+        getattr(source, "room_id", None) or
+        "unknown"
+    )
+
+
+# 依 WebhookHandler 註冊規則找出對應的處理函式
+def find_handler(handler, event):
+    func = None
+    if isinstance(event, MessageEvent):
+        func = handler._handlers.get(f"{type(event).__name__}_{type(event.message).__name__}")
+    if func is None:
+        func = handler._handlers.get(type(event).__name__)
+    return func or handler._default
+
+
+# processed（EventStore）有傳入時，已處理過或其他 worker 正在處理的 webhookEventId 直接略過；
+# 處理失敗時釋放紀錄，讓 LINE 重送時可以再處理
+def dispatch_event(handler, event, processed=None):
+    event_id = getattr(event, "webhook_event_id", None)
+    if processed is None or not event_id:
+        return _dispatch(handler, event)
+    if not processed.claim(event_id):
+        redelivery = getattr(getattr(event, "delivery_context", None), "is_redelivery", False)
+        logger.info(f"略過重複的事件 {event_id}（重送：{redelivery}）")
+        metrics.inc("webhook_events_total", result="duplicate")
+        return None
+    try:
+        result = _dispatch(handler, event)
+    except BaseException:
+        processed.release(event_id)
+        metrics.inc("webhook_events_total", result="failed")
+        raise
+    processed.finish(event_id)
+    metrics.inc("webhook_events_total", result="processed")
+    return result
+
+
+def _dispatch(handler, event):
+    func = find_handler(handler, event)
+    if func is None:
+        logger.info(f"沒有處理 {type(event).__name__} 的函式")
+        return None
+    return func(event)
+
+
+# 同一批 Webhook 的事件：不同用戶平行處理、同一用戶依序處理，全部完成才回傳。
+# 佇列放不下整批事件時一個都不處理，拋出 QueueFullError；任何事件失敗時，在其餘事件處理完後拋出第一個錯誤。
+def dispatch_payload(executor, handler, events, processed=None):
+    if len(events) == 1:
+        return [dispatch_event(handler, events[0], processed)]
+    futures = executor.submit_many([
+        (event_key(event), dispatch_event, (handler, event, processed)) for event in events
+    ])
+    wait(futures)
+    for future in futures:
+        if future.exception() is not None:
+            raise future.exception()
+    return [future.result() for future in futures]